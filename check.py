@@ -1,20 +1,15 @@
-import geopandas as gpd
+from road_graph import load_road_graph
 
-# === Load full shapefile ===
-edges = gpd.read_file("nwk_hcm/hcm_edges.shp")
-nodes = gpd.read_file("nwk_hcm/hcm_nodes.shp")
-
-# Normalize 'highway' column if it's a list
-if edges['highway'].apply(lambda x: isinstance(x, list)).any():
-    edges = edges.explode(column='highway', ignore_index=True)
+# === Load cached network (converted from nwk_hcm/*.shp on first use) ===
+graph = load_road_graph()
 
 # Count total
 print("📊 Entire Network:")
-print(f"🔗 Number of edges: {len(edges)}")
-print(f"📍 Number of nodes: {len(nodes)}")
+print(f"🔗 Number of edges: {graph.num_edges}")
+print(f"📍 Number of nodes: {graph.num_nodes}")
 
 # Count each highway type
-highway_counts = edges['highway'].value_counts()
+highway_counts = graph.highway_counts()
 print("\n📋 Highway types in the data:")
 print(highway_counts)
 
@@ -27,10 +22,9 @@ north = 10.857456509030797
 bbox = (west, south, east, north)
 
 # Filter edges that intersect the bounding box
-edges_in_bbox = edges.cx[west:east, south:north]
-nodes_in_bbox = nodes.cx[west:east, south:north]
+edges_in_bbox = graph.bbox_mask(bbox)
+nodes_in_bbox = graph.nodes_in_bbox(bbox)
 
 print("\n📦 Inside Bounding Box:")
-print(f"🔗 Edges: {len(edges_in_bbox)}")
-print(f"📍 Nodes: {len(nodes_in_bbox)}")
-
+print(f"🔗 Edges: {edges_in_bbox.sum()}")
+print(f"📍 Nodes: {nodes_in_bbox.sum()}")
@@ -0,0 +1,320 @@
+import io
+import os
+import csv
+import zlib
+import hashlib
+from functools import lru_cache
+import numpy as np
+
+DEFAULT_STORE_DIR = "data/hcm/geometries"
+
+# <table>.idx sidecars: record i is the byte offset of the row with ID i + 1
+OFFSET_DTYPE = np.dtype("<i8")
+
+
+def content_hash(text):
+    """Short, stable content hash used to intern geometries and chunks."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+
+
+def split_points(linestring):
+    """Return the "lon lat" tokens of a LINESTRING string, or [] if it is empty."""
+    start = linestring.find("(")
+    end = linestring.rfind(")")
+    if start < 0 or end <= start:
+        return []
+    return [p.strip() for p in linestring[start + 1:end].split(",")]
+
+
+def chunk_points(points, avg_points=16, min_points=4, max_points=256):
+    """
+    Split a point sequence into content-defined chunks.
+
+    A chunk ends after a point whose CRC32 is divisible by avg_points, so two routes
+    that share a prefix produce identical chunks up to shortly before they diverge and
+    re-synchronize after they rejoin.
+
+    Args:
+        points (list): "lon lat" tokens
+        avg_points (int): Expected chunk length
+        min_points (int): Shortest chunk (except the last)
+        max_points (int): Longest chunk; a cut is forced beyond it
+
+    Returns:
+        list: Lists of points; concatenated they equal points
+    """
+    chunks = []
+    start = 0
+    for i, point in enumerate(points):
+        length = i - start + 1
+        if length < min_points:
+            continue
+        if length >= max_points or zlib.crc32(point.encode("utf-8")) % avg_points == 0:
+            chunks.append(points[start:i + 1])
+            start = i + 1
+    if start < len(points):
+        chunks.append(points[start:])
+    return chunks
+
+
+def _csv_line(fields):
+    """Encode one table row exactly as csv.writer writes it."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(fields)
+    return buffer.getvalue().encode("utf-8")
+
+
+class _RowOffsets:
+    def __init__(self, csv_file):
+        """
+        Random access to the rows of an append-only store table by ID.
+
+        IDs are dense and assigned in write order, so the row with ID i is row i of the
+        table and record i - 1 of the <table>.idx sidecar holds its byte offset. Only the
+        writer appends to the sidecar; a reader that needs rows past its end (a store
+        written before sidecars existed, or rows appended since) scans on from there and
+        keeps just those offsets in memory.
+        """
+        self.csv_file = csv_file
+        self.idx_file = os.path.splitext(csv_file)[0] + ".idx"
+        self._index = None
+        self._tail = []           # offsets of the rows after the sidecar, from ID _tail_first
+        self._tail_first = 1
+        self._handle = None
+
+    def _load_index(self):
+        if not os.path.exists(self.idx_file) or os.path.getsize(self.idx_file) == 0:
+            return np.zeros(0, dtype=OFFSET_DTYPE)
+        return np.memmap(self.idx_file, dtype=OFFSET_DTYPE, mode="r")
+
+    def _scan(self, after=None):
+        """
+        Offsets of the complete rows following the row at byte `after` (from the start if None).
+
+        Returns:
+            tuple: (offsets, end) where end is the byte after the last complete row
+        """
+        offsets = []
+        if not os.path.exists(self.csv_file):
+            return offsets, 0
+        with open(self.csv_file, "rb") as f:
+            offset = 0
+            if after is not None:
+                f.seek(after)
+                offset = after + len(f.readline())
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partial row still being written
+                    break
+                offsets.append(offset)
+                offset += len(line)
+        return offsets, offset
+
+    def offset(self, row_id):
+        """Byte offset of the row with ID row_id, or None if the table has no such row."""
+        if self._index is None or row_id > len(self._index):
+            self._index = self._load_index()
+        if row_id <= len(self._index):
+            return int(self._index[row_id - 1])
+        if not self._tail:
+            self._tail_first = len(self._index) + 1
+        while self._tail_first + len(self._tail) <= row_id:
+            last = self._tail[-1] if self._tail else (int(self._index[-1]) if len(self._index) else None)
+            found, _ = self._scan(last)
+            if not found:
+                return None
+            self._tail.extend(found)
+        return self._tail[row_id - self._tail_first]
+
+    def read(self, row_id):
+        """Fields of the row with ID row_id, or None if there is none."""
+        offset = self.offset(row_id)
+        if offset is None:
+            return None
+        if self._handle is None:
+            self._handle = open(self.csv_file, "rb")
+        self._handle.seek(offset)
+        line = self._handle.readline()
+        if not line.endswith(b"\n"):
+            # Row not fully flushed by the writer yet
+            return None
+        fields = next(csv.reader([line.decode("utf-8").strip("\r\n")]))
+        if int(fields[0]) != row_id:
+            raise ValueError(f"Row at byte {offset} of '{self.csv_file}' has ID {fields[0]}, expected {row_id}")
+        return fields
+
+    def sync(self):
+        """
+        Make the sidecar cover exactly the complete rows of the table. Writer only.
+
+        Drops a partial last row and sidecar entries past it left by an interrupted write,
+        and indexes rows the sidecar is missing (e.g. in a store written before sidecars).
+        """
+        size = os.path.getsize(self.csv_file) if os.path.exists(self.csv_file) else 0
+        indexed = np.array(self._load_index())
+        indexed = indexed[indexed < size]
+        if len(indexed):
+            # The last indexed row itself may be the partial one
+            with open(self.csv_file, "rb") as f:
+                f.seek(int(indexed[-1]))
+                if not f.readline().endswith(b"\n"):
+                    indexed = indexed[:-1]
+        found, end = self._scan(int(indexed[-1]) if len(indexed) else None)
+        if end < size:
+            with open(self.csv_file, "r+b") as f:
+                f.truncate(end)
+        np.concatenate([indexed, np.array(found, dtype=OFFSET_DTYPE)]).tofile(self.idx_file)
+        self._index, self._tail = None, []
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+class GeometryStore:
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, chunked=True, avg_points=16, chunk_cache_size=4096):
+        """
+        Content-addressed store for trip geometries.
+
+        Complete geometries are interned by content hash, so byte-identical routes share one
+        geometry ID. With chunked=True each geometry is further split into content-defined
+        chunks that are interned separately, so alternatives sharing long prefixes share
+        their coordinate storage.
+
+        Both tables are append-only CSV files, each with a .idx sidecar of row offsets so
+        get() reads single rows instead of loading the tables:
+            chunks.csv      chunk_id, hash, points ("lon lat, lon lat, ...")
+            geometries.csv  geometry_id, hash, chunk_ids (space separated)
+
+        Args:
+            store_dir (str): Directory holding the two tables
+            chunked (bool): Split new geometries into shared chunks
+            avg_points (int): Expected chunk length in points
+            chunk_cache_size (int): Recently read chunks kept in memory by get()
+        """
+        self.store_dir = store_dir
+        self.chunked = chunked
+        self.avg_points = avg_points
+        self.chunks_file = os.path.join(store_dir, "chunks.csv")
+        self.geometries_file = os.path.join(store_dir, "geometries.csv")
+
+        self.chunk_ids = None     # hash -> chunk_id, loaded on first put()
+        self.geometry_ids = None  # hash -> geometry_id, loaded on first put()
+        self._chunk_rows = _RowOffsets(self.chunks_file)
+        self._geometry_rows = _RowOffsets(self.geometries_file)
+        self._chunk_text = lru_cache(maxsize=chunk_cache_size)(self._read_chunk)
+        self._files = []
+
+    def _load_hashes(self):
+        """Load the hash -> ID maps needed to intern new geometries."""
+        self.chunk_ids, self.geometry_ids = {}, {}
+        if os.path.exists(self.chunks_file):
+            with open(self.chunks_file, newline="", encoding="utf-8") as f:
+                for chunk_id, digest, _ in csv.reader(f):
+                    self.chunk_ids[digest] = int(chunk_id)
+        if os.path.exists(self.geometries_file):
+            with open(self.geometries_file, newline="", encoding="utf-8") as f:
+                for geometry_id, digest, _ in csv.reader(f):
+                    self.geometry_ids[digest] = int(geometry_id)
+
+    def _open_writers(self):
+        if not self._files:
+            os.makedirs(self.store_dir, exist_ok=True)
+            self._chunk_rows.sync()
+            self._geometry_rows.sync()
+            self._load_hashes()
+            # (table, sidecar) pairs, both appended in binary so offsets are exact
+            self._files = [open(self.chunks_file, "ab"), open(self._chunk_rows.idx_file, "ab"),
+                           open(self.geometries_file, "ab"), open(self._geometry_rows.idx_file, "ab")]
+
+    @staticmethod
+    def _append(table, sidecar, fields):
+        # The row goes first (and is flushed first), so a sidecar entry never precedes its row
+        offset = table.tell()
+        table.write(_csv_line(fields))
+        sidecar.write(np.array([offset], dtype=OFFSET_DTYPE).tobytes())
+
+    def _put_chunk(self, points):
+        text = ", ".join(points)
+        digest = content_hash(text)
+        chunk_id = self.chunk_ids.get(digest)
+        if chunk_id is None:
+            chunk_id = len(self.chunk_ids) + 1
+            self.chunk_ids[digest] = chunk_id
+            self._append(self._files[0], self._files[1], [chunk_id, digest, text])
+        return chunk_id
+
+    def put(self, linestring):
+        """
+        Intern a LINESTRING string.
+
+        Args:
+            linestring (str): Geometry as written to the trips CSV
+
+        Returns:
+            int | None: Geometry ID, or None for an empty geometry
+        """
+        points = split_points(linestring)
+        if not points:
+            return None
+        self._open_writers()
+        digest = content_hash(", ".join(points))
+        geometry_id = self.geometry_ids.get(digest)
+        if geometry_id is not None:
+            return geometry_id
+
+        pieces = chunk_points(points, self.avg_points) if self.chunked else [points]
+        chunk_ids = [self._put_chunk(piece) for piece in pieces]
+        geometry_id = len(self.geometry_ids) + 1
+        self.geometry_ids[digest] = geometry_id
+        self._append(self._files[2], self._files[3], [geometry_id, digest, " ".join(map(str, chunk_ids))])
+        return geometry_id
+
+    def _read_chunk(self, chunk_id):
+        fields = self._chunk_rows.read(chunk_id)
+        if fields is None:
+            raise KeyError(f"Unknown chunk {chunk_id} in '{self.chunks_file}'")
+        return fields[2]
+
+    def get(self, geometry_id):
+        """
+        Rebuild the LINESTRING string of a geometry ID.
+
+        Only the geometry's row and its chunk rows are read, by seeking.
+
+        Returns:
+            str: The geometry, or "" if geometry_id is empty or unknown
+        """
+        if geometry_id in (None, ""):
+            return ""
+        self.flush()
+        fields = self._geometry_rows.read(int(geometry_id))
+        if fields is None:
+            return ""
+        return "LINESTRING (" + ", ".join(self._chunk_text(int(c)) for c in fields[2].split()) + ")"
+
+    def resolve(self, row):
+        """Fill in row["geometry"] from row["geometry_id"] for trip rows written with a store."""
+        if "geometry" not in row and "geometry_id" in row:
+            row["geometry"] = self.get(row["geometry_id"])
+        return row
+
+    def flush(self):
+        """Flush pending appends to disk."""
+        for f in self._files:
+            f.flush()
+
+    def close(self):
+        """Flush and close the table files."""
+        for f in self._files:
+            f.close()
+        self._files = []
+        self._chunk_rows.close()
+        self._geometry_rows.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
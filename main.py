@@ -12,22 +12,27 @@ def main():
     parser.add_argument(
         "--api_type",
         type=str,
-        choices=["mapbox", "tomtom", "here"],
+        choices=["mapbox", "tomtom", "here", "router"],
         required=True,
-        help="API type to use: mapbox, tomtom, or here"
+        help=(
+            "API type to use: mapbox, tomtom, or here. "
+            "'router' spreads requests over Mapbox and TomTom by remaining quota and health"
+        )
     )
 
     # Scrape mode
     parser.add_argument(
         "--scrape_mode",
         type=str,
-        choices=["random_od_place", "random_od_seg", "specific"],
+        choices=["random_od_place", "random_od_seg", "specific", "coverage_od"],
         required=True,
         help=(
             "Type of scraping task to perform. "
             "For 'specific', you must have an 'input.txt' file "
             "in the same directory with at least 2 non-empty lines. "
-            "Each line should be either a place/segment name or lat,lon depending on your usage."
+            "Each line should be either a place/segment name or lat,lon depending on your usage. "
+            "'coverage_od' picks place pairs expected to cover the most unobserved road segments "
+            "(requires the cached road graph, see road_graph.py)."
         )
     )
 
@@ -39,6 +44,35 @@ def main():
         help="Number of routes to scrape or 'schedule' to follow daily time slots"
     )
 
+    # Geometry deduplication
+    parser.add_argument(
+        "--geometry_store",
+        type=str,
+        default=None,
+        help=(
+            "Directory of a geometry store. When set, identical geometries and shared "
+            "route prefixes are stored once and trip rows reference them by geometry_id"
+        )
+    )
+
+    # Raw response archive
+    parser.add_argument(
+        "--archive_raw",
+        type=str,
+        default=None,
+        help="Directory of a raw response archive; full provider responses are kept there, compressed"
+    )
+
+    # Batched validation and enrichment
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help=(
+            "Validate routes in batches before writing (empty geometry, impossible speed, "
+            "outside the HCM bbox), add derived columns and quarantine rejected rows"
+        )
+    )
+
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
         sys.exit(1)
@@ -56,83 +90,148 @@ def main():
     print(f"  API type    : {args.api_type}")
     print(f"  Scrape mode : {args.scrape_mode}")
     print(f"  Num routes   : {args.num_route}")
+    print(f"  Geometry store: {args.geometry_store or '-'}")
+    print(f"  Raw archive : {args.archive_raw or '-'}")
+    print(f"  Validate    : {args.validate}")
 
 
     org, des = None, None
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    if args.api_type == "mapbox": 
-        from mapbox_api import MapboxRouteFinder
-
-        mapbox = MapboxRouteFinder()
-        remaining = mapbox.get_remaining_requests()
-
-        if args.num_route == "schedule":
-            # TODO: Handle time-slot schedule logic
-            print("TODO: Scheduled scraping mode not implemented yet")
-            return
+    geometry_store = None
+    if args.geometry_store:
+        from geometry_store import GeometryStore
+        geometry_store = GeometryStore(args.geometry_store)
+    raw_archive = None
+    if args.archive_raw:
+        from raw_archive import RawResponseArchive
+        raw_archive = RawResponseArchive(args.archive_raw)
+    batch_writer = None
+    if args.validate:
+        from trip_validation import TripBatchWriter
+        batch_writer = TripBatchWriter(f"data/hcm/trips_{timestamp}.csv", geometry_store=geometry_store)
+
+    try:
+        if args.api_type == "mapbox": 
+            from mapbox_api import MapboxRouteFinder
+
+            mapbox = MapboxRouteFinder()
+            remaining = mapbox.get_remaining_requests()
+
+            if args.num_route == "schedule":
+                # TODO: Handle time-slot schedule logic
+                print("TODO: Scheduled scraping mode not implemented yet")
+                return
         
-        try:
-            num = int(args.num_route)
-        except ValueError:
-            print("num_route must be an integer or 'schedule'")
-            sys.exit(1)
-
-        if num > remaining:
-            print(f"Not enough request quota left. Requested: {num}, Remaining: {remaining}")
-            sys.exit(1)
-
-        print(f"Proceeding to scrape {num} routes using Mapbox API...")
-
-        for _ in range(num):
-
-            org, des = utils.get_od(args.scrape_mode)
-
-            data = mapbox.get_route_json(org, des)
-            if data is None:
-                print("Failed to get route data from Mapbox API")
-                continue
-            utils.process_mapbox_routes(data, f"data/hcm/trips_{timestamp}.csv")
-
-            # Simulate delay to avoid hitting rate limits
-            delay = random.uniform(0.5, 1.5)
-            time.sleep(delay)
-            print(f"Calling Mapbox API for route {_ + 1}")
+            try:
+                num = int(args.num_route)
+            except ValueError:
+                print("num_route must be an integer or 'schedule'")
+                sys.exit(1)
+
+            if num > remaining:
+                print(f"Not enough request quota left. Requested: {num}, Remaining: {remaining}")
+                sys.exit(1)
+
+            print(f"Proceeding to scrape {num} routes using Mapbox API...")
+
+            for _ in range(num):
+
+                org, des = utils.get_od(args.scrape_mode, geometry_store)
+
+                data = mapbox.get_route_json(org, des)
+                if data is None:
+                    print("Failed to get route data from Mapbox API")
+                    continue
+                routes = utils.process_mapbox_routes(data, f"data/hcm/trips_{timestamp}.csv",
+                                                     geometry_store=geometry_store, batch_writer=batch_writer)
+                if raw_archive is not None:
+                    raw_archive.append("mapbox", data, [r["trip_id"] for r in routes])
+
+                # Simulate delay to avoid hitting rate limits
+                delay = random.uniform(0.5, 1.5)
+                time.sleep(delay)
+                print(f"Calling Mapbox API for route {_ + 1}")
     
-    elif args.api_type == "tomtom":
-        from tomtom_api import TomTomRouteFinder
+        elif args.api_type == "tomtom":
+            from tomtom_api import TomTomRouteFinder
 
-        tomtom = TomTomRouteFinder()
-        remaining = tomtom.get_remaining_requests()
+            tomtom = TomTomRouteFinder()
+            remaining = tomtom.get_remaining_requests()
 
-        if args.num_route == "schedule":
-            print("TODO: Scheduled scraping mode not implemented yet")
-            return
+            if args.num_route == "schedule":
+                print("TODO: Scheduled scraping mode not implemented yet")
+                return
         
-        try:
-            num = int(args.num_route)
-        except ValueError:
-            print("num_route must be an integer or 'schedule'")
-            sys.exit(1)
-
-        if num > remaining:
-            print(f"Not enough request quota left. Requested: {num}, Remaining: {remaining}")
-            sys.exit(1)
-
-        print(f"Proceeding to scrape {num} routes using TomTom API...")
-
-        for i in range(num):
-            org, des = utils.get_od(args.scrape_mode)
-            data = tomtom.get_route_json(org, des)
-            if data is None:
-                print("Failed to get route data from TomTom API")
-                continue
-
-            utils.process_tomtom_routes(data, f"data/hcm/trips_{timestamp}.csv")
-
-            delay = random.uniform(0.5, 1.5)
-            time.sleep(delay)
-            print(f"TomTom route {i + 1} processed")
+            try:
+                num = int(args.num_route)
+            except ValueError:
+                print("num_route must be an integer or 'schedule'")
+                sys.exit(1)
+
+            if num > remaining:
+                print(f"Not enough request quota left. Requested: {num}, Remaining: {remaining}")
+                sys.exit(1)
+
+            print(f"Proceeding to scrape {num} routes using TomTom API...")
+
+            for i in range(num):
+                org, des = utils.get_od(args.scrape_mode, geometry_store)
+                data = tomtom.get_route_json(org, des)
+                if data is None:
+                    print("Failed to get route data from TomTom API")
+                    continue
+
+                routes = utils.process_tomtom_routes(data, f"data/hcm/trips_{timestamp}.csv",
+                                                     geometry_store=geometry_store, batch_writer=batch_writer)
+                if raw_archive is not None:
+                    raw_archive.append("tomtom", data, [r["trip_id"] for r in routes])
+
+                delay = random.uniform(0.5, 1.5)
+                time.sleep(delay)
+                print(f"TomTom route {i + 1} processed")
+
+        elif args.api_type == "router":
+            from route_router import RouteRouter, PROCESSORS
+
+            router = RouteRouter.from_default_providers()
+            remaining = router.get_remaining_requests()
+
+            if args.num_route == "schedule":
+                print("TODO: Scheduled scraping mode not implemented yet")
+                return
+
+            try:
+                num = int(args.num_route)
+            except ValueError:
+                print("num_route must be an integer or 'schedule'")
+                sys.exit(1)
+
+            if num > remaining:
+                print(f"Not enough request quota left across providers. Requested: {num}, Remaining: {remaining}")
+                sys.exit(1)
+
+            print(f"Proceeding to scrape {num} routes across providers...")
+
+            ods = (utils.get_od(args.scrape_mode, geometry_store) for _ in range(num))
+            for i, (org, des, provider, data) in enumerate(router.route_ods(ods)):
+                routes = PROCESSORS[provider](data, f"data/hcm/trips_{timestamp}.csv",
+                                              geometry_store=geometry_store, batch_writer=batch_writer)
+                if raw_archive is not None:
+                    raw_archive.append(provider, data, [r["trip_id"] for r in routes])
+
+                delay = random.uniform(0.5, 1.5)
+                time.sleep(delay)
+                print(f"Route {i + 1} processed via {provider}")
+
+            print(router.summary())
+
+    finally:
+        # Always flush buffered rows and geometries, also on errors and Ctrl-C,
+        # since their trip IDs are already saved in the trip counter
+        if batch_writer is not None:
+            batch_writer.close()
+        if geometry_store is not None:
+            geometry_store.close()
     
 if __name__ == "__main__":
     main()
@@ -0,0 +1,244 @@
+import os
+import csv
+import gzip
+import json
+import tarfile
+import zipfile
+import argparse
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import utils
+from raw_archive import RawResponseArchive, ARCHIVE_META, ArchivedFrame, decompress_frame
+
+RAW_SUFFIXES = (".json", ".json.gz")
+
+
+def _is_raw_response(name):
+    return name.lower().endswith(RAW_SUFFIXES)
+
+
+def iter_raw_responses(source):
+    """
+    Stream raw API responses from a directory or an archive, one file at a time.
+
+    Args:
+        source (str): Raw response archive directory (see raw_archive.py), or a directory
+                      (searched recursively), .zip, .tar, .tar.gz or .tgz archive
+                      containing *.json / *.json.gz responses
+
+    Yields:
+        tuple: (name, raw_bytes, mtime) in sorted name order for directories and zip
+               files, and in member order for tar archives
+    """
+    if os.path.isfile(os.path.join(source, ARCHIVE_META)):
+        # Frames stay compressed here and are decompressed in the worker processes
+        yield from RawResponseArchive(source).iter_frames()
+
+    elif os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files if _is_raw_response(name))
+        for path in sorted(paths):
+            with open(path, "rb") as f:
+                yield path, f.read(), int(os.path.getmtime(path))
+
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in sorted(archive.infolist(), key=lambda i: i.filename):
+                if info.is_dir() or not _is_raw_response(info.filename):
+                    continue
+                mtime = int(datetime(*info.date_time).timestamp())
+                yield info.filename, archive.read(info), mtime
+
+    elif tarfile.is_tarfile(source):
+        # Stream mode: members are read in archive order without building an index
+        with tarfile.open(source, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or not _is_raw_response(member.name):
+                    continue
+                yield member.name, archive.extractfile(member).read(), int(member.mtime)
+
+    else:
+        raise ValueError(f"Unsupported raw response source: {source}")
+
+
+def detect_provider(response):
+    """Guess which API produced a response from its structure: 'mapbox', 'tomtom', 'here' or None."""
+    routes = response.get("routes") or []
+    if "waypoints" in response or "code" in response:
+        return "mapbox"
+    if "formatVersion" in response or (routes and "legs" in routes[0] and "summary" in routes[0]):
+        return "tomtom"
+    if routes and "sections" in routes[0]:
+        return "here"
+    return None
+
+
+def _response_timestamp(response, provider, mtime):
+    """Best available request time: TomTom's departureTime, else the file's modification time."""
+    if provider == "tomtom":
+        try:
+            departure = response["routes"][0]["summary"]["departureTime"]
+            return int(datetime.fromisoformat(departure).timestamp())
+        except (KeyError, IndexError, ValueError):
+            pass
+    return mtime
+
+
+def normalize_raw_response(item):
+    """
+    Decode and flatten one raw response. Runs in a worker process.
+
+    Responses may be bare API payloads or wrapped as {"provider", "timestamp", "response"}
+    with optional "trip_ids", as stored by raw_archive. When trip_ids match the routes
+    one-to-one, each row keeps its original trip_id.
+
+    Args:
+        item (tuple): (seq, name, raw, mtime) where raw is bytes or an ArchivedFrame
+
+    Returns:
+        tuple: (seq, name, rows) where rows are dicts with timestamp, distance, duration
+               and geometry, or (seq, name, None) if the response could not be normalized
+    """
+    seq, name, raw, mtime = item
+    try:
+        if isinstance(raw, ArchivedFrame):
+            raw = decompress_frame(raw)
+        elif name.lower().endswith(".gz"):
+            raw = gzip.decompress(raw)
+        payload = json.loads(raw)
+    except Exception as e:
+        print(f"Error reading {name}: {e}")
+        return seq, name, None
+
+    response = payload.get("response", payload)
+    provider = payload.get("provider") or detect_provider(response)
+    if provider == "mapbox":
+        routes = utils.normalize_mapbox_routes(response)
+    elif provider == "tomtom":
+        routes = utils.normalize_tomtom_routes(response)
+    else:
+        print(f"Skipping {name}: unsupported provider {provider!r}")
+        return seq, name, None
+
+    timestamp = payload.get("timestamp") or _response_timestamp(response, provider, mtime)
+    rows = [{"timestamp": int(timestamp), **route} for route in routes]
+
+    trip_ids = payload.get("trip_ids") or []
+    if len(trip_ids) == len(rows):
+        for row, trip_id in zip(rows, trip_ids):
+            row["trip_id"] = int(trip_id)
+    elif trip_ids:
+        print(f"{name}: {len(trip_ids)} archived trip IDs for {len(rows)} routes, assigning new IDs")
+    return seq, name, rows
+
+
+def _numbered(items):
+    for seq, (name, raw, mtime) in enumerate(items):
+        yield seq, name, raw, mtime
+
+
+def normalize_stream(items, max_workers=None, max_pending=None):
+    """
+    Normalize raw responses in a process pool, yielding results in input order.
+
+    At most max_pending responses are in flight at once, so memory stays bounded no
+    matter how long the input stream is.
+
+    Args:
+        items (iterable): (name, raw_bytes, mtime) tuples, e.g. from iter_raw_responses
+        max_workers (int): Worker processes; defaults to the number of CPUs
+        max_pending (int): Bound on submitted but not yet consumed responses;
+                           defaults to 4 per worker
+
+    Yields:
+        tuple: (name, rows) as returned by normalize_raw_response
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or 4 * max_workers
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for item in _numbered(items):
+            pending.append(pool.submit(normalize_raw_response, item))
+            if len(pending) >= max_pending:
+                _, name, rows = pending.popleft().result()
+                yield name, rows
+        while pending:
+            _, name, rows = pending.popleft().result()
+            yield name, rows
+
+
+def renormalize_archive(source, csv_file, start_trip_id=1, max_workers=None, max_pending=None,
+                        geometry_store=None):
+    """
+    Re-derive a trips table from an archive of raw responses.
+
+    A single writer consumes the ordered result stream. Rows that carry their original
+    trip_id (responses from a raw_archive) keep it, so the rebuilt table agrees with the
+    archive's trip index; other rows get sequential IDs after the largest ID seen so far,
+    so the output is deterministic for a given archive.
+
+    Args:
+        source (str): Directory or archive of raw responses (see iter_raw_responses)
+        csv_file (str): Output trips CSV; overwritten
+        start_trip_id (int): First trip ID to assign to rows without an original trip_id
+        max_workers (int): Worker processes
+        max_pending (int): Bound on in-flight responses
+        geometry_store (GeometryStore): If given, write geometry IDs instead of geometries
+
+    Returns:
+        int: Number of trips written
+    """
+    next_trip_id = start_trip_id
+    responses = failed = written = 0
+    output_dir = os.path.dirname(csv_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    with open(csv_file, mode="w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        columns = utils.trip_columns(geometry_store)
+        writer.writerow(columns)
+        for name, rows in normalize_stream(iter_raw_responses(source), max_workers, max_pending):
+            responses += 1
+            if rows is None:
+                failed += 1
+                continue
+            for row in rows:
+                if "trip_id" not in row:
+                    row["trip_id"] = next_trip_id
+                next_trip_id = max(next_trip_id, row["trip_id"] + 1)
+                if geometry_store is not None:
+                    row["geometry_id"] = geometry_store.put(row["geometry"])
+                writer.writerow([row[column] for column in columns])
+                written += 1
+
+    print(f"✅ Normalized {responses} responses ({failed} failed) into {written} trips in '{csv_file}'")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-derive the trips table from archived raw API responses")
+    parser.add_argument("source", help="Raw response archive, directory or .zip/.tar(.gz) archive of raw JSON responses")
+    parser.add_argument("output", help="Trips CSV to write")
+    parser.add_argument("--start_trip_id", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max_pending", type=int, default=None)
+    parser.add_argument("--geometry_store", default=None,
+                        help="Directory of a geometry store; rows then reference geometries by ID")
+    args = parser.parse_args()
+
+    if args.geometry_store:
+        from geometry_store import GeometryStore
+
+        with GeometryStore(args.geometry_store) as store:
+            renormalize_archive(args.source, args.output, args.start_trip_id, args.workers,
+                                args.max_pending, store)
+    else:
+        renormalize_archive(args.source, args.output, args.start_trip_id, args.workers, args.max_pending)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import time
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+import utils
+from trip_query import TripIndex, DEFAULT_INDEX_DIR
+
+METERS_PER_DEGREE = 111320.0
+MINUTES_PER_DAY = 1440
+
+# First route of each provider's response is its recommended one
+NORMALIZERS = {
+    "mapbox": utils.normalize_mapbox_routes,
+    "tomtom": utils.normalize_tomtom_routes,
+}
+
+
+class ODCache:
+    def __init__(self, trip_index=None, spatial_tolerance_m=300.0, temporal_tolerance_min=30,
+                 utc_offset=None, rebuild_every=1000):
+        """
+        Nearest-neighbour lookup of scraped trips by origin, destination and time of day.
+
+        Trips are points in (origin lat/lon, destination lat/lon, time-of-day) space, scaled so
+        both tolerances become 1.0, and indexed in a KD-tree. Alternatives returned by the same
+        request share a timestamp; only the fastest of each request is used.
+
+        Args:
+            trip_index (TripIndex): Index of scraped trips; defaults to the one in data/index/trips
+            spatial_tolerance_m (float): Max distance between origins and between destinations
+            temporal_tolerance_min (float): Max difference in time of day, wrapping at midnight
+            utc_offset (int): Seconds east of UTC for the time-of-day index; defaults to local
+            rebuild_every (int): Rebuild the tree after this many trips were added with add()
+        """
+        self.spatial_tolerance_m = spatial_tolerance_m
+        self.temporal_tolerance_min = temporal_tolerance_min
+        self.utc_offset = utc_offset
+        self.rebuild_every = rebuild_every
+
+        trip_index = trip_index or TripIndex(DEFAULT_INDEX_DIR)
+        records = trip_index.records
+        valid = ~np.isnan(np.asarray(records["origin_lat"]))
+        self.trips = pd.DataFrame({
+            "trip_id": np.asarray(records["trip_id"])[valid],
+            "timestamp": np.asarray(records["timestamp"])[valid],
+            "origin_lat": np.asarray(records["origin_lat"])[valid],
+            "origin_lon": np.asarray(records["origin_lon"])[valid],
+            "dest_lat": np.asarray(records["dest_lat"])[valid],
+            "dest_lon": np.asarray(records["dest_lon"])[valid],
+            "distance": np.asarray(records["distance"])[valid],
+            "duration": np.asarray(records["duration"])[valid],
+        })
+        self.pending = []
+        self._build()
+
+    def _features(self, origin_lat, origin_lon, dest_lat, dest_lon, tod):
+        """Scale raw coordinates so each tolerance corresponds to a distance of 1.0 per axis."""
+        lat_scale = METERS_PER_DEGREE / self.spatial_tolerance_m
+        lon_scale = lat_scale * np.cos(np.radians(10.8))  # HCM latitude
+        return np.column_stack((
+            np.asarray(origin_lat) * lat_scale, np.asarray(origin_lon) * lon_scale,
+            np.asarray(dest_lat) * lat_scale, np.asarray(dest_lon) * lon_scale,
+            np.asarray(tod, dtype=float) / self.temporal_tolerance_min,
+        ))
+
+    def _build(self):
+        """(Re)build the KD-tree over all known trips."""
+        if self.pending:
+            self.trips = pd.concat([self.trips, pd.DataFrame(self.pending)], ignore_index=True)
+            self.pending = []
+        t = self.trips
+        tod = utils.time_of_day_index(t["timestamp"].to_numpy(), self.utc_offset)
+        self.tree = cKDTree(self._features(t["origin_lat"], t["origin_lon"], t["dest_lat"], t["dest_lon"], tod))
+
+    def add(self, trip_id, timestamp, origin, destination, distance, duration):
+        """
+        Make a freshly scraped trip available to lookups without rebuilding the index.
+
+        trip_id may be None for routes that were not written to a trips CSV; they are
+        reported with trip_id -1.
+        """
+        self.pending.append({
+            "trip_id": -1 if trip_id is None else int(trip_id), "timestamp": int(timestamp),
+            "origin_lat": origin[0], "origin_lon": origin[1],
+            "dest_lat": destination[0], "dest_lon": destination[1],
+            "distance": float(distance), "duration": float(duration),
+        })
+        if len(self.pending) >= self.rebuild_every:
+            self._build()
+
+    def neighbours(self, origin, destination, departure_time=None):
+        """
+        Scraped trips within tolerance of an OD at a time of day.
+
+        Args:
+            origin (list): [lat, lon]
+            destination (list): [lat, lon]
+            departure_time (int): Unix timestamp; defaults to now
+
+        Returns:
+            pd.DataFrame: Matching trips (fastest per request) with an extra "score" column
+                          (0 = identical, larger = further within tolerance)
+        """
+        departure_time = int(time.time()) if departure_time is None else departure_time
+        tod = int(utils.time_of_day_index([departure_time], self.utc_offset)[0])
+
+        # Query at tod and its images across midnight so the time axis wraps
+        shifted = [tod, tod - MINUTES_PER_DAY, tod + MINUTES_PER_DAY]
+        points = self._features([origin[0]] * 3, [origin[1]] * 3,
+                                [destination[0]] * 3, [destination[1]] * 3, shifted)
+        ids = sorted({i for hits in self.tree.query_ball_point(points, r=1.0, p=np.inf) for i in hits})
+        candidates = self.trips.iloc[ids]
+        if self.pending:
+            candidates = pd.concat([candidates, pd.DataFrame(self.pending)], ignore_index=True)
+        if candidates.empty:
+            return candidates.assign(score=pd.Series(dtype=float))
+
+        origin_m = utils.haversine_m(candidates["origin_lat"].to_numpy(), candidates["origin_lon"].to_numpy(),
+                               origin[0], origin[1])
+        dest_m = utils.haversine_m(candidates["dest_lat"].to_numpy(), candidates["dest_lon"].to_numpy(),
+                             destination[0], destination[1])
+        dt = np.abs(utils.time_of_day_index(candidates["timestamp"].to_numpy(), self.utc_offset) - tod)
+        dt = np.minimum(dt, MINUTES_PER_DAY - dt)
+        keep = ((origin_m <= self.spatial_tolerance_m) & (dest_m <= self.spatial_tolerance_m)
+                & (dt <= self.temporal_tolerance_min))
+        candidates = candidates[keep].assign(
+            score=(np.maximum(origin_m, dest_m) / self.spatial_tolerance_m
+                   + dt / self.temporal_tolerance_min)[keep])
+
+        # Alternatives of one request share a timestamp and OD; keep the fastest
+        candidates = candidates.sort_values("duration").drop_duplicates(
+            subset=["timestamp", "origin_lat", "origin_lon", "dest_lat", "dest_lon"], keep="first")
+        return candidates.sort_values("score")
+
+    def lookup(self, origin, destination, departure_time=None, interpolate=True):
+        """
+        Estimate duration and distance for an OD from nearby scraped trips.
+
+        Args:
+            origin (list): [lat, lon]
+            destination (list): [lat, lon]
+            departure_time (int): Unix timestamp; defaults to now
+            interpolate (bool): Inverse-score weighted mean of all neighbours instead of
+                                the single closest one
+
+        Returns:
+            dict | None: {"duration", "distance", "neighbours", "trip_id"} or None on a miss
+        """
+        found = self.neighbours(origin, destination, departure_time)
+        if found.empty:
+            return None
+        if interpolate:
+            weights = 1.0 / (found["score"].to_numpy() + 0.05)
+            duration = float(np.average(found["duration"], weights=weights))
+            distance = float(np.average(found["distance"], weights=weights))
+        else:
+            duration, distance = float(found["duration"].iloc[0]), float(found["distance"].iloc[0])
+        return {
+            "duration": duration,
+            "distance": distance,
+            "neighbours": len(found),
+            "trip_id": int(found["trip_id"].iloc[0]),
+        }
+
+
+class CachedRouteEstimator:
+    def __init__(self, cache, finder=None, provider="mapbox", csv_file=None, geometry_store=None):
+        """
+        Answer duration/distance queries from the OD cache, calling a provider only on a miss.
+
+        Args:
+            cache (ODCache): Nearest-neighbour cache of scraped trips
+            finder: Route finder used on a miss — a MapboxRouteFinder / TomTomRouteFinder, or a
+                    RouteRouter whose get_route_json returns (provider, response)
+            provider (str): Provider of finder when it is a single-provider finder
+            csv_file (str): If set, responses fetched on a miss are also written to this trips CSV
+            geometry_store (GeometryStore): Passed through to the trips CSV writer
+        """
+        self.cache = cache
+        self.finder = finder
+        self.provider = provider
+        self.csv_file = csv_file
+        self.geometry_store = geometry_store
+        self.hits = self.misses = 0
+
+    def estimate(self, origin, destination, departure_time=None):
+        """
+        Args:
+            origin (list): [lat, lon]
+            destination (list): [lat, lon]
+            departure_time (int): Unix timestamp; defaults to now
+
+        Returns:
+            dict | None: {"duration", "distance", "source"} where source is "cache" or the
+                         provider name, or None if the OD is not cached and no provider answered
+
+        Providers are queried for current traffic, so on a miss the answer reflects the
+        time of the request rather than departure_time, and is cached under the former.
+        """
+        departure_time = int(time.time()) if departure_time is None else departure_time
+        cached = self.cache.lookup(origin, destination, departure_time)
+        if cached is not None:
+            self.hits += 1
+            return {"duration": cached["duration"], "distance": cached["distance"], "source": "cache"}
+
+        self.misses += 1
+        if self.finder is None:
+            return None
+        requested_at = int(time.time())
+        result = self.finder.get_route_json(origin, destination)
+        provider, data = result if isinstance(result, tuple) else (self.provider, result)
+        if data is None:
+            return None
+
+        routes = NORMALIZERS[provider](data)
+        if not routes:
+            return None
+        if self.csv_file:
+            from route_router import PROCESSORS
+            PROCESSORS[provider](data, self.csv_file, geometry_store=self.geometry_store)
+
+        best = routes[0]
+        self.cache.add(None, requested_at, origin, destination, best["distance"], best["duration"])
+        return {"duration": float(best["duration"]), "distance": float(best["distance"]), "source": provider}
@@ -0,0 +1,305 @@
+import os
+import csv
+import glob
+import json
+import heapq
+import random
+import numpy as np
+import pandas as pd
+
+from utils import linestring_to_array
+
+DEFAULT_COVERAGE_DIR = "data/coverage"
+DEFAULT_TRIP_FILES = "data/hcm/trips*.csv"
+METERS_PER_DEGREE = 111320.0
+
+_KEY_OFFSET = 1 << 31
+
+
+def densify(coords, step):
+    """
+    Insert points along a polyline so consecutive points are at most step apart.
+
+    Args:
+        coords (np.ndarray): (n, 2) lon/lat
+        step (float): Maximum spacing in degrees
+
+    Returns:
+        np.ndarray: (m, 2) lon/lat including the original vertices
+    """
+    if len(coords) < 2:
+        return coords
+    deltas = np.diff(coords, axis=0)
+    steps = np.maximum(np.ceil(np.hypot(deltas[:, 0], deltas[:, 1]) / step).astype(np.int64), 1)
+    segment = np.repeat(np.arange(len(deltas)), steps)
+    fraction = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segment]
+    points = coords[segment] + deltas[segment] * fraction[:, None]
+    return np.vstack((points, coords[-1:]))
+
+
+def edge_midpoints(coord_ptr, coords):
+    """
+    Point halfway along each edge's polyline, vectorized over all edges.
+
+    Args:
+        coord_ptr (np.ndarray): (n_edges + 1,) CSR pointers into coords
+        coords (np.ndarray): (n_coords, 2) packed lon/lat of all edges
+
+    Returns:
+        np.ndarray: (n_edges, 2) lon/lat
+    """
+    coord_ptr = np.asarray(coord_ptr)
+    coords = np.asarray(coords)
+    starts, ends = coord_ptr[:-1], coord_ptr[1:] - 1
+    midpoints = coords[np.minimum(starts, len(coords) - 1)].copy() if len(coords) else np.empty((len(starts), 2))
+
+    # Cumulative length along the packed buffer, not counting the jumps between edges
+    owner = np.repeat(np.arange(len(starts)), np.diff(coord_ptr))
+    seg = np.hypot(*np.diff(coords, axis=0).T)
+    seg[owner[:-1] != owner[1:]] = 0.0
+    cum = np.concatenate(([0.0], np.cumsum(seg)))
+
+    multi = ends > starts
+    s, e = starts[multi], ends[multi]
+    target = (cum[s] + cum[e]) / 2
+    k = np.clip(np.searchsorted(cum, target, side="left"), s + 1, e)
+    span = cum[k] - cum[k - 1]
+    t = np.divide(target - cum[k - 1], span, out=np.zeros_like(span), where=span > 0)
+    midpoints[multi] = coords[k - 1] + (coords[k] - coords[k - 1]) * t[:, None]
+    return midpoints
+
+
+class CoverageMap:
+    def __init__(self, graph, coverage_dir=DEFAULT_COVERAGE_DIR, cell_size_m=50.0):
+        """
+        Bitmap of road-graph edges that already appear in scraped geometries.
+
+        Edges and route points are matched through a square grid: an edge counts as
+        observed once a (densified) route passes through the grid cell of its midpoint
+        (halfway along its geometry, so routes merely crossing its end node do not count).
+
+        Args:
+            graph (RoadGraph): Cached road graph (see road_graph.py)
+            coverage_dir (str): Directory for the persisted bitmap and scan offsets
+            cell_size_m (float): Grid cell size in metres
+        """
+        self.graph = graph
+        self.coverage_dir = coverage_dir
+        self.cell_deg = cell_size_m / METERS_PER_DEGREE
+        self.bitmap_file = os.path.join(coverage_dir, "covered.npy")
+        self.meta_file = os.path.join(coverage_dir, "meta.json")
+
+        # Cell of every edge's midpoint, and a CSR cell -> edges lookup
+        self.edge_cell = self.cell_keys(edge_midpoints(graph.coord_ptr, graph.coords))
+        self.edge_order = np.argsort(self.edge_cell, kind="stable")
+        self.sorted_cells = self.edge_cell[self.edge_order]
+
+        self.covered = np.zeros(graph.num_edges, dtype=bool)
+        self.meta = {"cell_size_m": cell_size_m, "edge_point": "midpoint", "files": {}}
+        self._load()
+
+    def _load(self):
+        """Load a previously saved bitmap if it matches the graph and grid."""
+        if not (os.path.exists(self.bitmap_file) and os.path.exists(self.meta_file)):
+            return
+        with open(self.meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        covered = np.load(self.bitmap_file)
+        if (len(covered) != self.graph.num_edges or meta.get("cell_size_m") != self.meta["cell_size_m"]
+                or meta.get("edge_point") != self.meta["edge_point"]):
+            print("Coverage bitmap does not match the road graph, starting a new one")
+            return
+        self.covered, self.meta = covered, meta
+
+    def save(self):
+        """Persist the bitmap and the per-file scan offsets."""
+        os.makedirs(self.coverage_dir, exist_ok=True)
+        np.save(self.bitmap_file, self.covered)
+        with open(self.meta_file, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+
+    def cell_keys(self, coords):
+        """Grid cell key of each lon/lat point."""
+        cells = np.floor(np.asarray(coords) / self.cell_deg).astype(np.int64) + _KEY_OFFSET
+        return (cells[:, 0] << 32) | cells[:, 1]
+
+    def route_cells(self, coords, radius_cells=0):
+        """
+        Unique cells a polyline passes through, optionally dilated by radius_cells.
+
+        Args:
+            coords (np.ndarray): (n, 2) lon/lat
+            radius_cells (int): Chebyshev radius of the dilation
+
+        Returns:
+            np.ndarray: Sorted unique cell keys
+        """
+        if len(coords) == 0:
+            return np.empty(0, dtype=np.int64)
+        cells = np.unique(self.cell_keys(densify(coords, self.cell_deg / 2)))
+        if radius_cells:
+            offsets = np.arange(-radius_cells, radius_cells + 1)
+            dx, dy = np.meshgrid(offsets, offsets)
+            shifts = (dx.ravel() << 32) + dy.ravel()
+            cells = np.unique((cells[:, None] + shifts[None, :]).ravel())
+        return cells
+
+    def edges_in_cells(self, cells):
+        """Edge indices whose midpoint lies in any of the given (sorted, unique) cells."""
+        lo = np.searchsorted(self.sorted_cells, cells, side="left")
+        hi = np.searchsorted(self.sorted_cells, cells, side="right")
+        hit = hi > lo
+        if not hit.any():
+            return np.empty(0, dtype=np.int64)
+        lo, hi = lo[hit], hi[hit]
+        counts = hi - lo
+        positions = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return self.edge_order[positions]
+
+    def observe(self, linestring):
+        """Mark the edges along one scraped geometry as covered; returns the number newly covered."""
+        edges = self.edges_in_cells(self.route_cells(linestring_to_array(linestring)))
+        new = int((~self.covered[edges]).sum())
+        self.covered[edges] = True
+        return new
+
+    def observe_trips(self, csv_files=DEFAULT_TRIP_FILES, geometry_store=None):
+        """
+        Update the bitmap from trips CSV rows appended since the last call.
+
+        Args:
+            csv_files (str | list): Glob pattern or list of trips CSV paths
+            geometry_store (GeometryStore): Resolves geometry_id columns, if trips use one
+
+        Returns:
+            int: Number of newly covered edges
+        """
+        paths = sorted(glob.glob(csv_files)) if isinstance(csv_files, str) else list(csv_files)
+        new = 0
+        for path in paths:
+            key = os.path.abspath(path)
+            size = os.path.getsize(path)
+            entry = self.meta["files"].get(key, {"rows": 0, "size": 0})
+            if size == entry["size"]:
+                continue
+            done = entry["rows"]
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                reader = csv.DictReader(f)
+                for i, row in enumerate(reader):
+                    if i < done:
+                        continue
+                    if geometry_store is not None:
+                        geometry_store.resolve(row)
+                    new += self.observe(row.get("geometry") or "")
+                    done = i + 1
+            # Rows already observed, and the size at that point to skip unchanged files
+            self.meta["files"][key] = {"rows": done, "size": size}
+        self.save()
+        print(f"Coverage: {self.covered.sum()} / {len(self.covered)} edges ({new} new)")
+        return new
+
+
+class CoverageSampler:
+    def __init__(self, coverage, places, trip_index=None, corridor_width_m=300.0, prior_radius_m=300.0):
+        """
+        Pick OD pairs that are expected to observe the most not-yet-covered road edges.
+
+        The expected edges of a candidate OD are those under an earlier scraped route with
+        nearby endpoints (if a trip index is given and has one), otherwise those in a
+        straight-line corridor between origin and destination.
+
+        Args:
+            coverage (CoverageMap): Coverage bitmap over the road graph
+            places (pd.DataFrame): Candidate places with lat and lon columns (place.csv)
+            trip_index (TripIndex): Optional index used to look up earlier routes near an OD
+            corridor_width_m (float): Width of the straight-line corridor
+            prior_radius_m (float): How close earlier routes' endpoints must be to reuse them
+        """
+        self.coverage = coverage
+        self.places = places[["lat", "lon"]].to_numpy(dtype=float)
+        self.trip_index = trip_index
+        self.corridor_radius = max(int(np.ceil(corridor_width_m / 2 / (coverage.cell_deg * METERS_PER_DEGREE))), 0)
+        self.prior_radius_m = prior_radius_m
+
+    def expected_edges(self, origin, destination):
+        """Edges a route between origin and destination ([lat, lon] each) is expected to observe."""
+        if self.trip_index is not None:
+            near = self.trip_index.query(od_near=(tuple(origin), tuple(destination), self.prior_radius_m))
+            prior = next(near, None)
+            if prior is not None:
+                cells = self.coverage.route_cells(linestring_to_array(prior.get("geometry") or ""), 1)
+                return self.coverage.edges_in_cells(cells)
+        line = np.array([[origin[1], origin[0]], [destination[1], destination[0]]])
+        return self.coverage.edges_in_cells(self.coverage.route_cells(line, self.corridor_radius))
+
+    def random_candidates(self, n):
+        """n random place pairs with distinct endpoints."""
+        pairs = []
+        for _ in range(n):
+            i, j = random.sample(range(len(self.places)), 2)
+            pairs.append((self.places[i].tolist(), self.places[j].tolist()))
+        return pairs
+
+    def sample_batch(self, batch_size, n_candidates=None):
+        """
+        Greedily select the batch of ODs with the largest marginal coverage gain.
+
+        Gains are submodular (edges claimed by an earlier pick no longer count), so a lazy
+        greedy over a max-heap only re-scores candidates that reach the top.
+
+        Args:
+            batch_size (int): Number of ODs to return
+            n_candidates (int): Random candidate pairs to score; defaults to 20 per pick
+
+        Returns:
+            list: [(origin, destination), ...] as [lat, lon] lists, best first
+        """
+        candidates = self.random_candidates(n_candidates or 20 * batch_size)
+        expected = [self.expected_edges(o, d) for o, d in candidates]
+        claimed = self.coverage.covered.copy()
+
+        heap = [(-int((~claimed[edges]).sum()), i) for i, edges in enumerate(expected)]
+        heapq.heapify(heap)
+        batch = []
+        while heap and len(batch) < batch_size:
+            _, i = heapq.heappop(heap)
+            gain = int((~claimed[expected[i]]).sum())
+            if heap and gain < -heap[0][0]:
+                heapq.heappush(heap, (-gain, i))
+                continue
+            claimed[expected[i]] = True
+            batch.append(candidates[i])
+        return batch
+
+
+_default_queue = []
+_default_sampler = None
+
+
+def next_coverage_od(batch_size=20, place_file="data/hcm/place.csv", geometry_store=None):
+    """
+    Next OD from a coverage-guided batch, refreshing coverage from scraped trips between batches.
+
+    Used by utils.get_od for the "coverage_od" scrape mode.
+
+    Args:
+        batch_size (int): ODs selected per batch
+        place_file (str): Candidate places CSV
+        geometry_store (GeometryStore): Store of the current run, needed to read geometries
+                                        of trips written with geometry IDs
+
+    Returns:
+        tuple: (origin, destination) as [lat, lon] lists
+    """
+    global _default_sampler
+    if _default_sampler is None:
+        from road_graph import load_road_graph
+
+        coverage = CoverageMap(load_road_graph())
+        places = pd.read_csv(place_file, encoding="utf-8-sig")
+        _default_sampler = CoverageSampler(coverage, places)
+
+    if not _default_queue:
+        _default_sampler.coverage.observe_trips(geometry_store=geometry_store)
+        _default_queue.extend(_default_sampler.sample_batch(batch_size))
+    return _default_queue.pop(0)
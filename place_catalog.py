@@ -0,0 +1,271 @@
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from utils import HCM_BBOX
+
+# Category -> OSM tag filter, same as nodes_check.py
+CATEGORY_TAGS = {
+    "university": {"amenity": "university"},
+    "market": {"shop": "supermarket"},
+    "marketplace": {"amenity": "marketplace"},
+    "hospital": {"amenity": "hospital"},
+    "school": {"amenity": "school"},
+    "park": {"leisure": "park"},
+    "police": {"amenity": "police"},
+    "tourist_attraction": {"tourism": "attraction"},
+    "shopping_mall": {"shop": "mall"},
+}
+
+# Layers of an OSM PBF as exposed by the GDAL OSM driver that can hold places
+PBF_LAYERS = ["points", "multipolygons"]
+
+DEFAULT_CACHE_DIR = "data/place_catalog"
+OUTPUT_COLUMNS = ["category", "name", "lat", "lon"]
+
+
+def source_fingerprint(path):
+    """Cheap change marker for a source file: absolute path, size and modification time."""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def _tag_values(gdf, key):
+    """
+    Return the values of an OSM tag as a Series.
+
+    The GDAL OSM driver only exposes common keys as columns and packs the rest into an
+    hstore-like "other_tags" string, so fall back to extracting the key from there.
+    """
+    if key in gdf.columns:
+        return gdf[key]
+    if "other_tags" in gdf.columns:
+        return gdf["other_tags"].str.extract(rf'"{key}"=>"([^"]*)"', expand=False)
+    return pd.Series(None, index=gdf.index, dtype=object)
+
+
+def _source_layers(source):
+    """Layers to read from a source: the PBF feature layers, or the single layer (None) of a shapefile."""
+    if source.lower().endswith((".pbf", ".osm")):
+        return PBF_LAYERS
+    return [None]
+
+
+def _read_layer(source, layer, bbox):
+    """Read one layer of a PBF/OSM extract, or the single layer of a shapefile when layer is None."""
+    import geopandas as gpd
+
+    if layer is None:
+        return gpd.read_file(source, bbox=bbox)
+    return gpd.read_file(source, layer=layer, bbox=bbox)
+
+
+def _match_category(gdf, category, tags):
+    """Places of one category in an already loaded layer, as category, name, lat, lon."""
+    match = pd.Series(False, index=gdf.index)
+    for key, value in tags.items():
+        match |= _tag_values(gdf, key) == value
+        if "fclass" in gdf.columns:
+            # Geofabrik shapefiles carry the tag value in a single "fclass" column
+            match |= gdf["fclass"] == value
+    gdf = gdf[match]
+
+    centroids = gdf.geometry.centroid
+    df = pd.DataFrame({
+        "category": category,
+        "name": gdf["name"] if "name" in gdf.columns else None,
+        "lat": centroids.y,
+        "lon": centroids.x,
+    })
+    return clean_names(df)
+
+
+def extract_categories(categories, source, layer=None, bbox=HCM_BBOX):
+    """
+    Extract several categories of places from one layer of a local OSM extract.
+
+    Runs in a worker process. The layer is read once and every category is matched
+    against it with vectorized tag comparisons, so categories sharing a source do not
+    each re-read it.
+
+    Args:
+        categories (dict): Category -> OSM tag filter, e.g. {"school": {"amenity": "school"}}
+        source (str): Path to an OSM PBF/XML extract or a shapefile
+        layer (str): PBF layer to read (see PBF_LAYERS), or None for a shapefile
+        bbox (tuple): (west, south, east, north) to restrict the read to
+
+    Returns:
+        dict: Category -> pd.DataFrame with columns category, name, lat, lon
+    """
+    gdf = _read_layer(source, layer, bbox)
+    return {category: _match_category(gdf, category, tags) for category, tags in categories.items()}
+
+
+def clean_names(df):
+    """Drop empty or placeholder names and strip whitespace and surrounding quotes."""
+    df = df[df["name"].notna()].copy()
+    df["name"] = df["name"].astype(str).str.strip()
+    df["name"] = df["name"].str.replace(r'^"(.*)"$', r'\1', regex=True)
+    df = df[(df["name"] != "") & (df["name"].str.lower() != "n/a")]
+    return df[OUTPUT_COLUMNS].reset_index(drop=True)
+
+
+class PlaceCatalogBuilder:
+    def __init__(self, sources, cache_dir=DEFAULT_CACHE_DIR, categories=None, bbox=HCM_BBOX):
+        """
+        Build the place catalog from local OSM extracts, caching each category separately.
+
+        Args:
+            sources (str | dict): Path to one extract used for every category, or a dict
+                                  mapping category -> extract path.
+            cache_dir (str): Directory for per-category results and the manifest
+            categories (dict): Category -> tag filter; defaults to CATEGORY_TAGS
+            bbox (tuple): (west, south, east, north) to restrict reads to
+        """
+        self.categories = categories or CATEGORY_TAGS
+        if isinstance(sources, str):
+            sources = {category: sources for category in self.categories}
+        self.sources = sources
+        self.cache_dir = cache_dir
+        self.bbox = bbox
+        self.manifest_file = os.path.join(cache_dir, "manifest.json")
+        self.manifest = {}
+        self._load_manifest()
+
+    def _load_manifest(self):
+        """Load the per-category build manifest if present."""
+        if os.path.exists(self.manifest_file):
+            try:
+                with open(self.manifest_file, "r", encoding="utf-8") as f:
+                    self.manifest = json.load(f)
+            except Exception as e:
+                print(f"Error loading manifest: {e}. Rebuilding all categories.")
+                self.manifest = {}
+
+    def _save_manifest(self):
+        """Save the per-category build manifest."""
+        with open(self.manifest_file, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2, ensure_ascii=False)
+
+    def _category_file(self, category):
+        return os.path.join(self.cache_dir, f"{category}.csv")
+
+    def _build_key(self, category):
+        """Hash of everything a category's result depends on."""
+        payload = json.dumps({
+            "source": source_fingerprint(self.sources[category]),
+            "tags": self.categories[category],
+            "bbox": list(self.bbox),
+        }, sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def stale_categories(self):
+        """Return the categories whose source, tag filter or bbox changed since the last build."""
+        stale = []
+        for category in self.categories:
+            entry = self.manifest.get(category)
+            if (entry is None or entry.get("key") != self._build_key(category)
+                    or not os.path.exists(self._category_file(category))):
+                stale.append(category)
+        return stale
+
+    def build(self, output_file="data/hcm/place.csv", max_workers=None, force=False):
+        """
+        Rebuild stale categories in parallel and write the deduplicated catalog.
+
+        Stale categories are grouped by source and each layer of a source is read by one
+        worker, which matches all of that source's categories against it. Parallelism is
+        therefore per (source, layer): a single PBF runs as two tasks and a single
+        shapefile as one, since spreading the matching of one loaded layer over processes
+        would mean pickling the whole layer to each of them. A category whose extraction
+        fails is dropped from the cache and from the catalog, which is then reported as
+        partial.
+
+        Args:
+            output_file (str): Output CSV (category, name, lat, lon)
+            max_workers (int): Worker processes; defaults to the number of CPUs
+            force (bool): Rebuild every category regardless of the manifest
+
+        Returns:
+            pd.DataFrame: The written catalog
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stale = list(self.categories) if force else self.stale_categories()
+        print(f"Rebuilding {len(stale)} of {len(self.categories)} categories: {', '.join(stale) or '-'}")
+
+        failed = []
+        if stale:
+            # One task per (source, layer): each layer is read once for all categories using it
+            by_source = {}
+            for category in stale:
+                by_source.setdefault(self.sources[category], {})[category] = self.categories[category]
+
+            parts = {category: [] for category in stale}
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = {
+                    (source, layer): pool.submit(extract_categories, categories, source, layer, self.bbox)
+                    for source, categories in by_source.items()
+                    for layer in _source_layers(source)
+                }
+                for (source, layer), future in futures.items():
+                    try:
+                        for category, df in future.result().items():
+                            parts[category].append(df)
+                    except Exception as e:
+                        where = f"layer '{layer}' of '{source}'" if layer else f"'{source}'"
+                        print(f"❌ Error reading {where}: {e}")
+                        failed.extend(c for c in by_source[source] if c not in failed)
+
+            for category in stale:
+                if category in failed:
+                    # Never merge a stale result for a category that failed to rebuild
+                    self.manifest.pop(category, None)
+                    if os.path.exists(self._category_file(category)):
+                        os.remove(self._category_file(category))
+                    continue
+                df = pd.concat(parts[category], ignore_index=True)
+                df.to_csv(self._category_file(category), index=False, encoding="utf-8-sig")
+                self.manifest[category] = {"key": self._build_key(category), "count": len(df)}
+                print(f"🔍 {category}: {len(df)} places")
+            self._save_manifest()
+
+        frames = [pd.read_csv(self._category_file(category), encoding="utf-8-sig")
+                  for category in self.categories
+                  if os.path.exists(self._category_file(category))]
+        if not frames:
+            print("No categories were built.")
+            return pd.DataFrame(columns=OUTPUT_COLUMNS)
+
+        # Categories are concatenated in declaration order, so keep="first" matches nodes_check.py
+        df = pd.concat(frames, ignore_index=True).drop_duplicates(subset="name", keep="first")
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        df.to_csv(output_file, index=False, encoding="utf-8-sig")
+        if failed:
+            print(f"⚠️ Saved a partial catalog of {len(df)} places to '{output_file}'; "
+                  f"missing categories: {', '.join(failed)}")
+        else:
+            print(f"✅ Saved {len(df)} places to '{output_file}'")
+        return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the place catalog from a local OSM extract")
+    parser.add_argument("source", help="Path to an OSM PBF/XML extract or a shapefile")
+    parser.add_argument("--output", default="data/hcm/place.csv")
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="Rebuild all categories")
+    args = parser.parse_args()
+
+    builder = PlaceCatalogBuilder(args.source, cache_dir=args.cache_dir)
+    builder.build(args.output, max_workers=args.workers, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
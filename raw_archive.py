@@ -0,0 +1,288 @@
+import os
+import json
+import time
+from collections import namedtuple
+import numpy as np
+import zstandard as zstd
+
+DEFAULT_ARCHIVE_DIR = "data/raw_archive"
+ARCHIVE_META = "archive.json"
+
+# One record per archived response; record i describes request_id i + 1, so a request is
+# found by position instead of by search.
+REQUEST_RECORD_DTYPE = np.dtype([
+    ("request_id", "<i8"),
+    ("offset", "<i8"),
+    ("length", "<i4"),
+    ("dict_version", "<i4"),
+    ("timestamp", "<i8"),
+    ("first_trip_id", "<i8"),
+    ("n_trips", "<i4"),
+])
+
+# Dense trip_id -> (provider, request_id) map; record i describes trip_id i + 1.
+# Trip IDs that were never archived are left as zeros.
+TRIP_RECORD_DTYPE = np.dtype([
+    ("provider", "<i4"),
+    ("request_id", "<i8"),
+])
+
+# A still-compressed archived response, decompressed by whoever consumes it (e.g. a
+# normalize_archive worker process) rather than by the reader of the archive.
+ArchivedFrame = namedtuple("ArchivedFrame", ["archive_dir", "provider", "dict_version", "frame"])
+
+_frame_dicts = {}
+
+
+def decompress_frame(archived):
+    """
+    Decompress an ArchivedFrame to its payload bytes.
+
+    Dictionaries are loaded once per process and cached.
+    """
+    dictionary = None
+    if archived.dict_version:
+        key = (archived.archive_dir, archived.provider, archived.dict_version)
+        if key not in _frame_dicts:
+            path = os.path.join(archived.archive_dir, f"{archived.provider}.dict.{archived.dict_version}")
+            with open(path, "rb") as f:
+                _frame_dicts[key] = zstd.ZstdCompressionDict(f.read())
+        dictionary = _frame_dicts[key]
+    return zstd.ZstdDecompressor(dict_data=dictionary).decompress(archived.frame)
+
+
+class RawResponseArchive:
+    def __init__(self, archive_dir=DEFAULT_ARCHIVE_DIR, level=10, train_after=200, dict_size=112640):
+        """
+        Append-only archive of raw API responses with O(1) random access.
+
+        Each response is stored as an independent zstd frame in <provider>.zst, compressed
+        with a dictionary trained on earlier responses of the same provider (once enough
+        of them exist), so one response can be read back without decompressing the rest.
+        <provider>.idx holds one fixed-size record per request and trips.idx maps trip
+        IDs to their request.
+
+        Args:
+            archive_dir (str): Archive directory
+            level (int): zstd compression level
+            train_after (int): Train a provider's first dictionary once it has this many responses
+            dict_size (int): Dictionary size in bytes
+        """
+        self.archive_dir = archive_dir
+        self.level = level
+        self.train_after = train_after
+        self.dict_size = dict_size
+        self.meta_file = os.path.join(archive_dir, ARCHIVE_META)
+        self.trip_map_file = os.path.join(archive_dir, "trips.idx")
+        self.meta = {"providers": {}}
+        self._dicts = {}
+        os.makedirs(archive_dir, exist_ok=True)
+        self._load_meta()
+
+    def _load_meta(self):
+        """Load archive metadata if present."""
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+
+    def _save_meta(self):
+        """Save archive metadata."""
+        with open(self.meta_file, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+
+    def _path(self, name):
+        return os.path.join(self.archive_dir, name)
+
+    def _provider(self, provider):
+        """Metadata entry of a provider, registering it on first use."""
+        providers = self.meta["providers"]
+        if provider not in providers:
+            providers[provider] = {"code": len(providers) + 1, "dict_version": 0}
+            self._save_meta()
+        return providers[provider]
+
+    def _provider_name(self, code):
+        for name, entry in self.meta["providers"].items():
+            if entry["code"] == code:
+                return name
+        return None
+
+    def _dictionary(self, provider, version):
+        """Load (and cache) one dictionary version; version 0 means no dictionary."""
+        if version == 0:
+            return None
+        key = (provider, version)
+        if key not in self._dicts:
+            with open(self._path(f"{provider}.dict.{version}"), "rb") as f:
+                self._dicts[key] = zstd.ZstdCompressionDict(f.read())
+        return self._dicts[key]
+
+    def _requests(self, provider):
+        """Memory-mapped request records of a provider."""
+        path = self._path(f"{provider}.idx")
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=REQUEST_RECORD_DTYPE)
+        return np.memmap(path, dtype=REQUEST_RECORD_DTYPE, mode="r")
+
+    def count(self, provider):
+        """Number of archived responses of a provider."""
+        return len(self._requests(provider))
+
+    def train_dictionary(self, provider, max_samples=1000):
+        """
+        Train a new dictionary version from the provider's archived responses.
+
+        Later responses are compressed with it; earlier ones keep the version they were
+        written with.
+
+        Returns:
+            int: The new dictionary version
+        """
+        entry = self._provider(provider)
+        n = self.count(provider)
+        step = max(n // max_samples, 1)
+        samples = [self._read_raw(provider, request_id) for request_id in range(1, n + 1, step)]
+        dictionary = zstd.train_dictionary(self.dict_size, samples, level=self.level)
+
+        version = entry["dict_version"] + 1
+        with open(self._path(f"{provider}.dict.{version}"), "wb") as f:
+            f.write(dictionary.as_bytes())
+        entry["dict_version"] = version
+        self._save_meta()
+        print(f"Trained {provider} dictionary v{version} from {len(samples)} responses")
+        return version
+
+    def append(self, provider, response, trip_ids=(), timestamp=None):
+        """
+        Archive one raw response.
+
+        Args:
+            provider (str): Provider name, e.g. "mapbox"
+            response (dict): Raw API response
+            trip_ids (list): Trip IDs assigned to the response's routes, e.g. from the
+                             processed routes returned by process_mapbox_routes
+            timestamp (int): Request time; defaults to now
+
+        Returns:
+            int: Request ID of the archived response within the provider
+        """
+        entry = self._provider(provider)
+        if entry["dict_version"] == 0 and self.count(provider) >= self.train_after:
+            self.train_dictionary(provider)
+
+        timestamp = int(time.time()) if timestamp is None else int(timestamp)
+        trip_ids = [int(t) for t in trip_ids]
+        payload = json.dumps({
+            "provider": provider,
+            "timestamp": timestamp,
+            "trip_ids": trip_ids,
+            "response": response,
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+        version = entry["dict_version"]
+        compressor = zstd.ZstdCompressor(level=self.level, dict_data=self._dictionary(provider, version))
+        frame = compressor.compress(payload)
+
+        with open(self._path(f"{provider}.zst"), "ab") as f:
+            offset = f.tell()
+            f.write(frame)
+
+        request_id = self.count(provider) + 1
+        record = np.array([(request_id, offset, len(frame), version, timestamp,
+                            trip_ids[0] if trip_ids else 0, len(trip_ids))], dtype=REQUEST_RECORD_DTYPE)
+        with open(self._path(f"{provider}.idx"), "ab") as f:
+            record.tofile(f)
+
+        if trip_ids:
+            self._map_trips(entry["code"], request_id, trip_ids)
+        return request_id
+
+    def _map_trips(self, provider_code, request_id, trip_ids):
+        """Write trip_id -> request entries into the dense trip map."""
+        mode = "r+b" if os.path.exists(self.trip_map_file) else "w+b"
+        record = np.array([(provider_code, request_id)], dtype=TRIP_RECORD_DTYPE).tobytes()
+        with open(self.trip_map_file, mode) as f:
+            for trip_id in trip_ids:
+                f.seek((trip_id - 1) * TRIP_RECORD_DTYPE.itemsize)
+                f.write(record)
+
+    def _read_raw(self, provider, request_id):
+        """Decompressed payload bytes of one request."""
+        requests = self._requests(provider)
+        if not 1 <= request_id <= len(requests):
+            raise KeyError(f"No {provider} request {request_id}")
+        record = requests[request_id - 1]
+        with open(self._path(f"{provider}.zst"), "rb") as f:
+            f.seek(int(record["offset"]))
+            frame = f.read(int(record["length"]))
+        dictionary = self._dictionary(provider, int(record["dict_version"]))
+        return zstd.ZstdDecompressor(dict_data=dictionary).decompress(frame)
+
+    def get(self, provider, request_id):
+        """
+        Read back one archived response.
+
+        Returns:
+            dict: {"provider", "timestamp", "trip_ids", "response"}
+        """
+        return json.loads(self._read_raw(provider, request_id))
+
+    def get_by_trip(self, trip_id):
+        """
+        Read back the response a trip came from.
+
+        Returns:
+            dict | None: As get(), or None if the trip was not archived
+        """
+        if not os.path.exists(self.trip_map_file) or trip_id < 1:
+            return None
+        offset = (trip_id - 1) * TRIP_RECORD_DTYPE.itemsize
+        if offset + TRIP_RECORD_DTYPE.itemsize > os.path.getsize(self.trip_map_file):
+            return None
+        with open(self.trip_map_file, "rb") as f:
+            f.seek(offset)
+            record = np.frombuffer(f.read(TRIP_RECORD_DTYPE.itemsize), dtype=TRIP_RECORD_DTYPE)[0]
+        provider = self._provider_name(int(record["provider"]))
+        if provider is None:
+            return None
+        return self.get(provider, int(record["request_id"]))
+
+    def iter_frames(self):
+        """
+        Stream every archived response, still compressed, in the order requests were made.
+
+        Requests of all providers are merged by timestamp, then first trip ID (trip IDs
+        come from one global counter), then per-provider request ID.
+
+        Yields:
+            tuple: (name, ArchivedFrame, timestamp) as expected by normalize_archive.normalize_stream
+        """
+        providers = list(self.meta["providers"])
+        tables = [np.asarray(self._requests(provider)) for provider in providers]
+        if not any(len(t) for t in tables):
+            return
+        records = np.concatenate(tables)
+        provider_index = np.repeat(np.arange(len(providers)), [len(t) for t in tables])
+        order = np.lexsort((records["request_id"], records["first_trip_id"], records["timestamp"]))
+
+        handles = {}
+        try:
+            for i in order:
+                provider = providers[provider_index[i]]
+                record = records[i]
+                if provider not in handles:
+                    handles[provider] = open(self._path(f"{provider}.zst"), "rb")
+                f = handles[provider]
+                f.seek(int(record["offset"]))
+                frame = ArchivedFrame(self.archive_dir, provider, int(record["dict_version"]),
+                                      f.read(int(record["length"])))
+                yield f"{provider}/{int(record['request_id'])}.json", frame, int(record["timestamp"])
+        finally:
+            for f in handles.values():
+                f.close()
+
+    def stats(self, provider):
+        """Archived response count and compressed size of a provider, in bytes."""
+        path = self._path(f"{provider}.zst")
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return {"responses": self.count(provider), "compressed_bytes": size}
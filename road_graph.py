@@ -0,0 +1,332 @@
+import os
+import ast
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+DEFAULT_EDGES_FILE = "nwk_hcm/hcm_edges.shp"
+DEFAULT_NODES_FILE = "nwk_hcm/hcm_nodes.shp"
+DEFAULT_CACHE_DIR = "data/road_graph"
+
+# Arrays written by build_road_graph, all loadable with np.load(mmap_mode="r").
+# Edges are stored sorted by source node, so edge i of every per-edge array is
+# the i-th entry of the CSR adjacency.
+GRAPH_ARRAYS = [
+    "node_osmid",     # (n_nodes,) int64
+    "node_xy",        # (n_nodes, 2) float64 lon/lat
+    "indptr",         # (n_nodes + 1,) int64 — out-edges of node k are indptr[k]:indptr[k + 1]
+    "edge_target",    # (n_edges,) int32 target node index
+    "edge_length",    # (n_edges,) float32 metres
+    "edge_highway",   # (n_edges,) uint64 bitmask over the highway vocabulary
+    "name_ptr",       # (n_edges + 1,) int64 — names of edge i are name_ids[name_ptr[i]:name_ptr[i + 1]]
+    "name_ids",       # (n_names_total,) int32 index into the name vocabulary
+    "coord_ptr",      # (n_edges + 1,) int64 — geometry of edge i is coords[coord_ptr[i]:coord_ptr[i + 1]]
+    "coords",         # (n_coords, 2) float64 lon/lat
+    "edge_bbox",      # (n_edges, 4) float64 minx, miny, maxx, maxy
+]
+
+
+def split_tag(value):
+    """
+    Normalize an OSM tag value into a list of strings.
+
+    OSMnx stores multi-valued tags as lists, which end up as "['a', 'b']" strings once
+    written to a shapefile. Both forms (and plain strings) are accepted.
+    """
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    value = str(value).strip()
+    if value.startswith("[") and value.endswith("]"):
+        try:
+            return [str(v) for v in ast.literal_eval(value)]
+        except (ValueError, SyntaxError):
+            pass
+    return [value] if value else []
+
+
+def _ragged_to_csr(lists, vocab):
+    """Encode a list of string lists as (ptr, ids) against vocab, extending vocab in place."""
+    lookup = {name: i for i, name in enumerate(vocab)}
+    counts = np.fromiter((len(items) for items in lists), dtype=np.int64, count=len(lists))
+    ids = np.empty(counts.sum(), dtype=np.int32)
+    pos = 0
+    for items in lists:
+        for item in items:
+            if item not in lookup:
+                lookup[item] = len(vocab)
+                vocab.append(item)
+            ids[pos] = lookup[item]
+            pos += 1
+    ptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ptr[1:])
+    return ptr, ids
+
+
+def build_road_graph(edges_file=DEFAULT_EDGES_FILE, nodes_file=DEFAULT_NODES_FILE, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Convert the OSMnx edge/node shapefiles into the compact on-disk graph format.
+
+    Args:
+        edges_file (str): Edge shapefile with u, v, highway, name, length and geometry
+        nodes_file (str): Node shapefile with osmid and geometry; optional, node
+                          coordinates fall back to edge endpoints when missing
+        cache_dir (str): Output directory
+
+    Returns:
+        RoadGraph: The freshly written graph, loaded with mmap
+    """
+    import geopandas as gpd
+    import shapely
+
+    edges = gpd.read_file(edges_file)
+    print(f"Converting {len(edges)} edges from '{edges_file}'")
+
+    u = edges["u"].to_numpy(dtype=np.int64)
+    v = edges["v"].to_numpy(dtype=np.int64)
+    coords, coord_owner = shapely.get_coordinates(edges.geometry.values, return_index=True)
+
+    if nodes_file and os.path.exists(nodes_file):
+        nodes = gpd.read_file(nodes_file)
+        node_osmid = nodes["osmid"].to_numpy(dtype=np.int64)
+        node_xy = np.column_stack((nodes.geometry.x.to_numpy(), nodes.geometry.y.to_numpy()))
+        order = np.argsort(node_osmid)
+        node_osmid, node_xy = node_osmid[order], node_xy[order]
+        missing = np.setdiff1d(np.concatenate((u, v)), node_osmid)
+        if len(missing):
+            print(f"{len(missing)} edge endpoints are missing from '{nodes_file}', taking them from edges")
+    else:
+        node_osmid = np.empty(0, dtype=np.int64)
+        node_xy = np.empty((0, 2))
+        missing = np.unique(np.concatenate((u, v)))
+
+    if len(missing):
+        # Use the first coordinate of an outgoing edge (or last of an incoming one)
+        starts = np.searchsorted(coord_owner, np.arange(len(edges)), side="left")
+        ends = np.searchsorted(coord_owner, np.arange(len(edges)), side="right") - 1
+        endpoint_osmid = np.concatenate((u, v))
+        endpoint_xy = np.concatenate((coords[starts], coords[ends]))
+        first = np.unique(endpoint_osmid, return_index=True)[1]
+        lookup = pd.Series(np.arange(len(first)), index=endpoint_osmid[first])
+        extra_xy = endpoint_xy[first][lookup.loc[missing].to_numpy()]
+        node_osmid = np.concatenate((node_osmid, missing))
+        node_xy = np.concatenate((node_xy, extra_xy))
+        order = np.argsort(node_osmid)
+        node_osmid, node_xy = node_osmid[order], node_xy[order]
+
+    src = np.searchsorted(node_osmid, u)
+    dst = np.searchsorted(node_osmid, v)
+
+    # Store edges in CSR order (by source node)
+    edge_order = np.argsort(src, kind="stable")
+    indptr = np.zeros(len(node_osmid) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(node_osmid)), out=indptr[1:])
+
+    highway_vocab, name_vocab = [], []
+    highway_ptr, highway_ids = _ragged_to_csr([split_tag(x) for x in edges["highway"].to_numpy()[edge_order]],
+                                              highway_vocab)
+    if len(highway_vocab) > 64:
+        raise ValueError(f"Too many highway classes for a 64-bit mask: {len(highway_vocab)}")
+    edge_highway = np.zeros(len(edges), dtype=np.uint64)
+    highway_owner = np.repeat(np.arange(len(edges)), np.diff(highway_ptr))
+    np.bitwise_or.at(edge_highway, highway_owner, np.left_shift(np.uint64(1), highway_ids.astype(np.uint64)))
+
+    names = edges["name"] if "name" in edges.columns else pd.Series([None] * len(edges))
+    name_ptr, name_ids = _ragged_to_csr([split_tag(x) for x in names.to_numpy()[edge_order]], name_vocab)
+
+    # Pack the coordinate buffer in CSR order as well
+    counts = np.bincount(coord_owner, minlength=len(edges))
+    old_ptr = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum(counts, out=old_ptr[1:])
+    coord_ptr = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum(counts[edge_order], out=coord_ptr[1:])
+    gather = np.repeat(old_ptr[edge_order] - coord_ptr[:-1], counts[edge_order]) + np.arange(coord_ptr[-1])
+    packed = coords[gather]
+
+    starts = coord_ptr[:-1]
+    edge_bbox = np.full((len(edges), 4), np.nan)
+    nonempty = counts[edge_order] > 0
+    if nonempty.any():
+        s = starts[nonempty]
+        edge_bbox[nonempty] = np.column_stack((
+            np.minimum.reduceat(packed[:, 0], s), np.minimum.reduceat(packed[:, 1], s),
+            np.maximum.reduceat(packed[:, 0], s), np.maximum.reduceat(packed[:, 1], s),
+        ))
+
+    arrays = {
+        "node_osmid": node_osmid,
+        "node_xy": node_xy,
+        "indptr": indptr,
+        "edge_target": dst[edge_order].astype(np.int32),
+        "edge_length": edges["length"].to_numpy(dtype=np.float32)[edge_order],
+        "edge_highway": edge_highway,
+        "name_ptr": name_ptr,
+        "name_ids": name_ids,
+        "coord_ptr": coord_ptr,
+        "coords": packed,
+        "edge_bbox": edge_bbox,
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(cache_dir, f"{name}.npy"), array)
+
+    stat = os.stat(edges_file)
+    meta = {
+        "source": os.path.abspath(edges_file),
+        "source_size": stat.st_size,
+        "source_mtime": int(stat.st_mtime),
+        "highway_vocab": highway_vocab,
+        "name_vocab": name_vocab,
+    }
+    with open(os.path.join(cache_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    print(f"✅ Saved road graph ({len(node_osmid)} nodes, {len(edges)} edges) to '{cache_dir}'")
+    return RoadGraph(cache_dir)
+
+
+def load_road_graph(edges_file=DEFAULT_EDGES_FILE, nodes_file=DEFAULT_NODES_FILE, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Load the cached road graph, converting the shapefile first if the cache is missing or stale.
+
+    Returns:
+        RoadGraph
+    """
+    meta_file = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_file):
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if not os.path.exists(edges_file):
+            return RoadGraph(cache_dir)
+        stat = os.stat(edges_file)
+        if meta.get("source_size") == stat.st_size and meta.get("source_mtime") == int(stat.st_mtime):
+            return RoadGraph(cache_dir)
+    return build_road_graph(edges_file, nodes_file, cache_dir)
+
+
+class RoadGraph:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        """Open a graph written by build_road_graph; arrays are memory-mapped, not read."""
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.highway_vocab = meta["highway_vocab"]
+        self.name_vocab = meta["name_vocab"]
+        for name in GRAPH_ARRAYS:
+            setattr(self, name, np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r"))
+
+    @property
+    def num_nodes(self):
+        return len(self.node_osmid)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_target)
+
+    def node_index(self, osmid):
+        """Return the node index of an OSM node id, or None if it is not in the graph."""
+        i = int(np.searchsorted(self.node_osmid, osmid))
+        if i < self.num_nodes and self.node_osmid[i] == osmid:
+            return i
+        return None
+
+    def out_edges(self, node):
+        """Return (edge indices, target node indices) of the out-edges of a node index."""
+        start, end = self.indptr[node], self.indptr[node + 1]
+        return np.arange(start, end), np.asarray(self.edge_target[start:end])
+
+    def edge_sources(self):
+        """Source node index of every edge, expanded from the CSR pointers."""
+        return np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+
+    def edge_coords(self, edge):
+        """Return the (n, 2) lon/lat geometry of one edge."""
+        return np.asarray(self.coords[self.coord_ptr[edge]:self.coord_ptr[edge + 1]])
+
+    def edge_names(self, edge):
+        """Return the list of names of one edge."""
+        ids = self.name_ids[self.name_ptr[edge]:self.name_ptr[edge + 1]]
+        return [self.name_vocab[i] for i in ids]
+
+    def highway_bits(self, classes):
+        """Bitmask selecting the given highway classes; unknown classes are ignored."""
+        bits = np.uint64(0)
+        for cls in classes:
+            if cls in self.highway_vocab:
+                bits |= np.uint64(1) << np.uint64(self.highway_vocab.index(cls))
+        return bits
+
+    def highway_mask(self, classes=("primary", "primary_link")):
+        """Boolean edge mask: edges tagged with any of the given highway classes."""
+        return (np.asarray(self.edge_highway) & self.highway_bits(classes)) != 0
+
+    def bbox_mask(self, bbox):
+        """Boolean edge mask: edges whose bounding box intersects (west, south, east, north)."""
+        west, south, east, north = bbox
+        b = np.asarray(self.edge_bbox)
+        return (b[:, 0] <= east) & (b[:, 2] >= west) & (b[:, 1] <= north) & (b[:, 3] >= south)
+
+    def nodes_in_bbox(self, bbox):
+        """Boolean node mask: nodes inside (west, south, east, north)."""
+        west, south, east, north = bbox
+        xy = np.asarray(self.node_xy)
+        return (xy[:, 0] >= west) & (xy[:, 0] <= east) & (xy[:, 1] >= south) & (xy[:, 1] <= north)
+
+    def highway_counts(self, mask=None):
+        """Number of edges per highway class, counting each class of multi-valued edges."""
+        highway = np.asarray(self.edge_highway)
+        if mask is not None:
+            highway = highway[mask]
+        counts = {cls: int(((highway >> np.uint64(i)) & np.uint64(1)).sum())
+                  for i, cls in enumerate(self.highway_vocab)}
+        return pd.Series(counts, dtype=np.int64).sort_values(ascending=False)
+
+    def edge_name_table(self, mask=None):
+        """
+        Explode edges into one row per (edge, name) pair.
+
+        Args:
+            mask (np.ndarray): Optional boolean edge mask
+
+        Returns:
+            pd.DataFrame: Columns edge, name_id
+        """
+        counts = np.diff(self.name_ptr)
+        edge = np.repeat(np.arange(self.num_edges), counts)
+        table = pd.DataFrame({"edge": edge, "name_id": np.asarray(self.name_ids)})
+        if mask is not None:
+            table = table[mask[edge]]
+        return table
+
+    def road_list(self, classes=("primary", "primary_link")):
+        """
+        Road names with any of the given highway classes, and the sorted classes each one has.
+
+        Returns:
+            pd.DataFrame: Columns name, highway (list of classes), as in primary_road_list.csv
+        """
+        bits = self.highway_bits(classes)
+        table = self.edge_name_table(self.highway_mask(classes))
+        table["highway"] = np.asarray(self.edge_highway)[table["edge"].to_numpy()] & bits
+        grouped = table.groupby("name_id")["highway"].agg(np.bitwise_or.reduce)
+        names = [self.name_vocab[i] for i in grouped.index]
+        classes_per_name = [
+            sorted(cls for i, cls in enumerate(self.highway_vocab) if int(mask) >> i & 1)
+            for mask in grouped.to_numpy()
+        ]
+        return pd.DataFrame({"name": names, "highway": classes_per_name}).sort_values("name").reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the HCM road network into the cached graph format")
+    parser.add_argument("--edges", default=DEFAULT_EDGES_FILE)
+    parser.add_argument("--nodes", default=DEFAULT_NODES_FILE)
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+    build_road_graph(args.edges, args.nodes, args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
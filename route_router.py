@@ -0,0 +1,195 @@
+import time
+from collections import deque
+
+import utils
+
+# Requests per minute allowed by each provider's free tier
+DEFAULT_PER_MINUTE_LIMITS = {
+    "mapbox": 300,
+    "tomtom": 300,
+}
+
+# How each provider's response is written to the trips CSV
+PROCESSORS = {
+    "mapbox": utils.process_mapbox_routes,
+    "tomtom": utils.process_tomtom_routes,
+}
+
+
+class ProviderStats:
+    def __init__(self, name, per_minute_limit, alpha=0.2):
+        """
+        Rolling health statistics for one provider.
+
+        Args:
+            name (str): Provider name
+            per_minute_limit (int): Maximum requests in any 60 second window
+            alpha (float): Smoothing factor of the latency and error-rate moving averages
+        """
+        self.name = name
+        self.per_minute_limit = per_minute_limit
+        self.alpha = alpha
+        self.latency = 1.0          # seconds, exponential moving average
+        self.error_rate = 0.0       # exponential moving average of failures
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.recent = deque()       # start times of requests in the last minute
+
+    def _prune(self, now):
+        while self.recent and now - self.recent[0] >= 60:
+            self.recent.popleft()
+
+    def minute_headroom(self, now):
+        """Requests still allowed in the current 60 second window."""
+        self._prune(now)
+        return self.per_minute_limit - len(self.recent)
+
+    def next_free_slot(self, now):
+        """Seconds until the per-minute window has room again."""
+        self._prune(now)
+        if len(self.recent) < self.per_minute_limit:
+            return 0.0
+        return 60 - (now - self.recent[0])
+
+    def record(self, started, latency, success):
+        """Update the statistics with the outcome of one request."""
+        self.recent.append(started)
+        self.latency = (1 - self.alpha) * self.latency + self.alpha * latency
+        self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha * (0.0 if success else 1.0)
+        if success:
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            # Back off 2, 4, 8 ... seconds, capped at five minutes
+            self.cooldown_until = time.time() + min(2 ** self.consecutive_failures, 300)
+
+
+class RouteRouter:
+    def __init__(self, finders, per_minute_limits=None):
+        """
+        Spread route requests over several providers according to their remaining quota and health.
+
+        Args:
+            finders (dict): Provider name -> route finder (MapboxRouteFinder, TomTomRouteFinder, ...)
+                            exposing get_remaining_requests() and get_route_json(origin, destination)
+            per_minute_limits (dict): Provider name -> requests per minute; defaults to
+                                      DEFAULT_PER_MINUTE_LIMITS
+        """
+        limits = {**DEFAULT_PER_MINUTE_LIMITS, **(per_minute_limits or {})}
+        self.finders = finders
+        self.stats = {name: ProviderStats(name, limits.get(name, 60)) for name in finders}
+
+    @classmethod
+    def from_default_providers(cls):
+        """Router over the Mapbox and TomTom finders with their default daily quotas."""
+        from mapbox_api import MapboxRouteFinder
+        from tomtom_api import TomTomRouteFinder
+
+        return cls({"mapbox": MapboxRouteFinder(), "tomtom": TomTomRouteFinder()})
+
+    def get_remaining_requests(self):
+        """Total remaining daily requests across all providers."""
+        return sum(finder.get_remaining_requests() for finder in self.finders.values())
+
+    def score(self, name, now):
+        """
+        Preference for sending the next request to a provider; 0 means unavailable.
+
+        Providers with more remaining daily quota, lower latency and fewer recent errors are
+        preferred, so quotas drain roughly together and a failing provider is backed off.
+        """
+        stats = self.stats[name]
+        remaining = self.finders[name].get_remaining_requests()
+        if remaining <= 0 or stats.minute_headroom(now) <= 0 or now < stats.cooldown_until:
+            return 0.0
+        return remaining * (1.0 - stats.error_rate) / max(stats.latency, 0.05)
+
+    def ranked_providers(self, now=None):
+        """Available providers, best first."""
+        now = now or time.time()
+        scores = {name: self.score(name, now) for name in self.finders}
+        return [name for name, score in sorted(scores.items(), key=lambda kv: -kv[1]) if score > 0]
+
+    def wait_time(self, now=None):
+        """
+        Seconds until some provider with daily quota left can accept a request,
+        or None if every daily quota is exhausted.
+        """
+        now = now or time.time()
+        waits = [
+            max(self.stats[name].next_free_slot(now), self.stats[name].cooldown_until - now, 0.0)
+            for name, finder in self.finders.items()
+            if finder.get_remaining_requests() > 0
+        ]
+        return min(waits) if waits else None
+
+    def get_route_json(self, origin, destination):
+        """
+        Request a route, failing over to the next best provider when one fails.
+
+        Args:
+            origin (list): [lat, lon]
+            destination (list): [lat, lon]
+
+        Returns:
+            tuple: (provider name, response dict), or (None, None) if every available
+                   provider failed or none is available right now
+        """
+        for name in self.ranked_providers():
+            started = time.time()
+            data = self.finders[name].get_route_json(origin, destination)
+            self.stats[name].record(started, time.time() - started, data is not None)
+            if data is not None:
+                return name, data
+            print(f"{name} failed for {origin} -> {destination}, trying next provider")
+        return None, None
+
+    def route_ods(self, ods, max_attempts=3):
+        """
+        Route a sequence of ODs, re-queueing any OD that no provider could serve.
+
+        Waits for per-minute headroom or failure cooldowns when every provider is busy,
+        and stops once every daily quota is exhausted.
+
+        Args:
+            ods (iterable): (origin, destination) pairs
+            max_attempts (int): Rounds over all providers before an OD is dropped
+
+        Yields:
+            tuple: (origin, destination, provider name, response dict)
+        """
+        ods = iter(ods)
+        retries = deque()
+        while True:
+            if retries:
+                org, des, attempts = retries.popleft()
+            else:
+                od = next(ods, None)
+                if od is None:
+                    return
+                (org, des), attempts = od, 0
+
+            wait = self.wait_time()
+            if wait is None:
+                print(f"All provider quotas exhausted, stopping at OD {org} -> {des}")
+                return
+            if wait > 0:
+                time.sleep(wait)
+
+            name, data = self.get_route_json(org, des)
+            if data is not None:
+                yield org, des, name, data
+            elif attempts + 1 < max_attempts:
+                retries.append((org, des, attempts + 1))
+            else:
+                print(f"Dropping OD {org} -> {des} after {max_attempts} attempts")
+
+    def summary(self):
+        """One line per provider with remaining quota and health statistics."""
+        lines = []
+        for name, stats in self.stats.items():
+            lines.append(
+                f"{name}: remaining={self.finders[name].get_remaining_requests()} "
+                f"latency={stats.latency:.2f}s error_rate={stats.error_rate:.2f}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,524 @@
+import os
+import csv
+import glob
+import json
+import shutil
+import argparse
+from contextlib import contextmanager
+import numpy as np
+
+from utils import linestring_to_array, time_of_day_index, haversine_m
+
+DEFAULT_INDEX_DIR = "data/index/trips"
+DEFAULT_TRIP_FILES = "data/hcm/trips*.csv"
+
+# One fixed-size record per indexed trip; the geometry itself stays in the CSV and is
+# only read back (through file_id / offset / length) for candidates that pass the index.
+TRIP_RECORD_DTYPE = np.dtype([
+    ("trip_id", "<i8"),
+    ("timestamp", "<i8"),
+    ("distance", "<f8"),
+    ("duration", "<f8"),
+    ("minx", "<f8"),
+    ("miny", "<f8"),
+    ("maxx", "<f8"),
+    ("maxy", "<f8"),
+    ("origin_lat", "<f8"),
+    ("origin_lon", "<f8"),
+    ("dest_lat", "<f8"),
+    ("dest_lon", "<f8"),
+    ("file_id", "<i4"),
+    ("offset", "<i8"),
+    ("length", "<i4"),
+])
+
+def build_str_tree(minx, miny, maxx, maxy, capacity=16):
+    """
+    Bulk-load a static R-tree with Sort-Tile-Recursive packing.
+
+    Args:
+        minx, miny, maxx, maxy (np.ndarray): Bounding boxes of the items; NaN boxes are skipped.
+        capacity (int): Maximum number of children per node.
+
+    Returns:
+        tuple: (levels, leaf_order) where levels is a list of (k, 4) node bbox arrays from the
+               root down to the leaf level, and leaf_order maps leaf slots to item indices.
+               Node i of a level owns slots [i * capacity, (i + 1) * capacity) of the next one.
+    """
+    cx = (minx + maxx) / 2
+    cy = (miny + maxy) / 2
+    ids = np.nonzero(~np.isnan(cx))[0]
+    if len(ids) == 0:
+        return [], ids
+
+    n_leaves = int(np.ceil(len(ids) / capacity))
+    n_slices = int(np.ceil(np.sqrt(n_leaves)))
+    ids = ids[np.argsort(cx[ids], kind="stable")]
+    slice_key = np.arange(len(ids)) // (n_slices * capacity)
+    leaf_order = ids[np.lexsort((cy[ids], slice_key))]
+
+    boxes = np.column_stack((minx[leaf_order], miny[leaf_order],
+                             maxx[leaf_order], maxy[leaf_order]))
+    levels = []
+    while True:
+        starts = np.arange(0, len(boxes), capacity)
+        boxes = np.column_stack((
+            np.minimum.reduceat(boxes[:, 0], starts),
+            np.minimum.reduceat(boxes[:, 1], starts),
+            np.maximum.reduceat(boxes[:, 2], starts),
+            np.maximum.reduceat(boxes[:, 3], starts),
+        ))
+        levels.insert(0, boxes)
+        if len(boxes) == 1:
+            break
+    return levels, leaf_order
+
+
+def search_str_tree(levels, leaf_order, bbox, capacity=16):
+    """
+    Return the item indices whose node path intersects bbox (minx, miny, maxx, maxy).
+
+    The search walks one level at a time, testing every surviving node of a level in a
+    single vectorized comparison.
+    """
+    if not levels:
+        return np.empty(0, dtype=np.int64)
+    qminx, qminy, qmaxx, qmaxy = bbox
+    candidates = np.arange(len(levels[0]))
+    sizes = [len(level) for level in levels[1:]] + [len(leaf_order)]
+    for level, next_size in zip(levels, sizes):
+        boxes = level[candidates]
+        hit = candidates[(boxes[:, 0] <= qmaxx) & (boxes[:, 2] >= qminx) &
+                         (boxes[:, 1] <= qmaxy) & (boxes[:, 3] >= qminy)]
+        children = (hit[:, None] * capacity + np.arange(capacity)).ravel()
+        candidates = children[children < next_size]
+    return np.asarray(leaf_order[candidates])
+
+
+class TripIndex:
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR, node_capacity=16, geometry_store=None):
+        """
+        Persistent spatio-temporal index over one or more trips CSV files.
+
+        Args:
+            index_dir (str): Directory holding the record file, R-tree levels and metadata.
+            node_capacity (int): R-tree fan-out used when the tree is (re)built.
+            geometry_store (GeometryStore): Store used to resolve geometry_id columns of
+                                            trips written with geometry deduplication.
+        """
+        self.index_dir = index_dir
+        self.geometry_store = geometry_store
+        self.records_file = os.path.join(index_dir, "records.bin")
+        self.meta_file = os.path.join(index_dir, "meta.json")
+        self.lock_file = os.path.join(index_dir, "update.lock")
+        self.node_capacity = node_capacity
+        self._load_meta()
+
+    def _load_meta(self):
+        """Load index metadata if the index already exists. Never writes to the index."""
+        self.meta = {"files": [], "node_capacity": self.node_capacity, "num_levels": 0, "num_records": 0}
+        if os.path.exists(self.meta_file):
+            try:
+                with open(self.meta_file, "r", encoding="utf-8") as f:
+                    self.meta = json.load(f)
+            except Exception as e:
+                print(f"Error loading index metadata: {e}. Starting a new index.")
+        # Indexes written before num_records was tracked are trusted as they are
+        self.meta.setdefault("num_records", self._stored_records())
+
+    def _save_meta(self):
+        """Save index metadata atomically; this commits the records it counts."""
+        tmp_file = self.meta_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_file, self.meta_file)
+
+    def _truncate_records(self, committed):
+        """
+        Drop records past the first `committed` ones. Only called by update(), under its lock.
+
+        update() appends records before it saves the metadata that counts them, so an
+        interrupted update leaves records at the end of records.bin whose CSV rows the
+        metadata still treats as unread.
+        """
+        extra = self._stored_records() - committed
+        if extra <= 0:
+            return
+        print(f"Discarding {extra} uncommitted index records from an interrupted update.")
+        with open(self.records_file, "r+b") as f:
+            f.truncate(committed * TRIP_RECORD_DTYPE.itemsize)
+
+    @contextmanager
+    def _update_lock(self):
+        """Hold an exclusive lock on the index directory; released when the process exits."""
+        with open(self.lock_file, "a+b") as f:
+            try:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            except ImportError:
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            yield  # closing the file releases the lock
+
+    def _path(self, *names):
+        return os.path.join(self.index_dir, *names)
+
+    def _tree_path(self, name):
+        """Path of a tree file of the committed generation (indexes built before generations keep them at the top)."""
+        generation = self.meta.get("tree_generation")
+        if generation is None:
+            return self._path(name)
+        return self._path(f"tree_{generation}", name)
+
+    def _stored_records(self):
+        """Number of records in records.bin, including any not yet committed."""
+        if not os.path.exists(self.records_file):
+            return 0
+        return os.path.getsize(self.records_file) // TRIP_RECORD_DTYPE.itemsize
+
+    @property
+    def records(self):
+        """
+        Memory-mapped view of the committed trip records.
+
+        Records an update() in progress has appended but not yet committed are ignored.
+        """
+        count = min(self.meta["num_records"], self._stored_records())
+        if count == 0:
+            return np.zeros(0, dtype=TRIP_RECORD_DTYPE)
+        return np.memmap(self.records_file, dtype=TRIP_RECORD_DTYPE, mode="r", shape=(count,))
+
+    def update(self, csv_files=DEFAULT_TRIP_FILES):
+        """
+        Index rows appended to the trips CSV files since the last update.
+
+        Trip files are append-only, so each file is read from the byte offset where the
+        previous update stopped. The R-tree and timestamp order are rebuilt afterwards.
+        Updates hold a lock on the index directory. New records and the tree built over
+        them only count once the metadata is saved at the end, so readers opened meanwhile
+        keep seeing the last committed state; records left by an interrupted update are
+        dropped by the next one.
+
+        Args:
+            csv_files (str | list): Glob pattern or list of trips CSV paths.
+
+        Returns:
+            int: Number of newly indexed trips.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        paths = sorted(glob.glob(csv_files)) if isinstance(csv_files, str) else list(csv_files)
+        added = 0
+
+        with self._update_lock():
+            # Another process may have committed since this index was opened
+            self._load_meta()
+            committed = self.meta["num_records"]
+            self._truncate_records(committed)
+            known = {entry["path"]: entry for entry in self.meta["files"]}
+
+            try:
+                with open(self.records_file, "ab") as out:
+                    for path in paths:
+                        path = os.path.abspath(path)
+                        entry = known.get(path)
+                        if entry is None:
+                            entry = {"path": path, "file_id": len(self.meta["files"]), "size": 0, "columns": None}
+                            self.meta["files"].append(entry)
+                            known[path] = entry
+
+                        size = os.path.getsize(path)
+                        if size < entry["size"]:
+                            print(f"Skipping '{path}': file shrank since it was indexed.")
+                            continue
+                        if size == entry["size"]:
+                            continue
+
+                        batch = self._scan_file(entry)
+                        batch.tofile(out)
+                        added += len(batch)
+
+                previous = self.meta.get("tree_generation")
+                if added or previous is None:
+                    self.meta["num_records"] = self._stored_records()
+                    self.meta["tree_generation"] = (previous or 0) + 1
+                    self._rebuild()
+                self._save_meta()
+            except BaseException:
+                # Roll back to the last committed records and metadata; the committed
+                # tree generation was never touched
+                self._truncate_records(committed)
+                self._load_meta()
+                raise
+            if self.meta["tree_generation"] != previous:
+                self._remove_old_trees(previous)
+
+        print(f"Indexed {added} new trips ({len(self.records)} total).")
+        return added
+
+    def _scan_file(self, entry):
+        """Read new rows of one trips CSV into index records, tracking byte offsets."""
+        rows = []
+        if entry["columns"] is not None:
+            self._check_columns(entry)
+        with open(entry["path"], "rb") as f:
+            f.seek(entry["size"])
+            offset = entry["size"]
+            for line in f:
+                line_offset, offset = offset, offset + len(line)
+                if not line.endswith(b"\n"):
+                    # Partial row still being written; pick it up on the next update.
+                    offset = line_offset
+                    break
+                text = line.decode("utf-8-sig").strip("\r\n")
+                if not text:
+                    continue
+                values = next(csv.reader([text]))
+                if entry["columns"] is None:
+                    entry["columns"] = values
+                    self._check_columns(entry)
+                    continue
+                row = self._resolve(dict(zip(entry["columns"], values)))
+                try:
+                    rows.append(self._make_record(row, entry["file_id"], line_offset, len(line)))
+                except (KeyError, ValueError) as e:
+                    print(f"Skipping malformed row at byte {line_offset} of '{entry['path']}': {e}")
+            entry["size"] = offset
+        return np.array(rows, dtype=TRIP_RECORD_DTYPE)
+
+    def _check_columns(self, entry):
+        """Refuse files whose geometries can only be resolved through a geometry store we lack."""
+        columns = entry["columns"]
+        if "geometry_id" in columns and "geometry" not in columns and self.geometry_store is None:
+            raise ValueError(f"'{entry['path']}' references geometries by geometry_id; "
+                             f"pass the GeometryStore it was written with to index it")
+
+    def _resolve(self, row):
+        """Attach the geometry of rows that only reference it by geometry_id."""
+        if self.geometry_store is not None:
+            self.geometry_store.resolve(row)
+        return row
+
+    @staticmethod
+    def _make_record(row, file_id, offset, length):
+        """Build one index record from a parsed CSV row."""
+        coords = linestring_to_array(row.get("geometry", ""))
+        if len(coords):
+            minx, miny = coords.min(axis=0)
+            maxx, maxy = coords.max(axis=0)
+            (olon, olat), (dlon, dlat) = coords[0], coords[-1]
+        else:
+            minx = miny = maxx = maxy = olat = olon = dlat = dlon = np.nan
+        return (int(row["trip_id"]), int(float(row["timestamp"])),
+                float(row["distance"] or 0.0), float(row["duration"] or 0.0),
+                minx, miny, maxx, maxy, olat, olon, dlat, dlon,
+                file_id, offset, length)
+
+    def _rebuild(self):
+        """
+        Build the R-tree levels and the sorted timestamp index over meta["num_records"]
+        records, into the directory of meta["tree_generation"].
+        """
+        records = self.records
+        capacity = self.meta["node_capacity"]
+        levels, leaf_order = build_str_tree(
+            np.asarray(records["minx"]), np.asarray(records["miny"]),
+            np.asarray(records["maxx"]), np.asarray(records["maxy"]), capacity)
+        os.makedirs(os.path.dirname(self._tree_path("rtree_leaves.npy")), exist_ok=True)
+        for i, level in enumerate(levels):
+            np.save(self._tree_path(f"rtree_level_{i}.npy"), level)
+        np.save(self._tree_path("rtree_leaves.npy"), leaf_order)
+        np.save(self._tree_path("time_order.npy"), np.argsort(records["timestamp"], kind="stable"))
+        self.meta["num_levels"] = len(levels)
+
+    def _remove_old_trees(self, keep):
+        """
+        Delete tree generations older than the current one and `keep`.
+
+        The previous generation is kept for readers that opened the index before the
+        update committed.
+        """
+        current = self.meta["tree_generation"]
+        for path in glob.glob(self._path("tree_*")):
+            suffix = os.path.basename(path)[len("tree_"):]
+            if suffix.isdigit() and int(suffix) not in (current, keep):
+                shutil.rmtree(path, ignore_errors=True)
+        if keep is None:
+            # Tree files of an index built before generations
+            for path in glob.glob(self._path("rtree_*.npy")) + glob.glob(self._path("time_order.npy")):
+                os.remove(path)
+
+    def _load_tree(self):
+        levels = [np.load(self._tree_path(f"rtree_level_{i}.npy"), mmap_mode="r")
+                  for i in range(self.meta["num_levels"])]
+        leaf_order = np.load(self._tree_path("rtree_leaves.npy"), mmap_mode="r")
+        return levels, leaf_order
+
+    def candidates(self, bbox=None, time_range=None, time_of_day=None, min_duration=None,
+                   od_near=None, utc_offset=None):
+        """
+        Return record indices matching the query using the index only (no geometry parsing).
+
+        See query() for the meaning of the arguments.
+        """
+        records = self.records
+        if len(records) == 0:
+            return np.empty(0, dtype=np.int64)
+        mask = None
+
+        def narrow(ids):
+            nonlocal mask
+            selected = np.zeros(len(records), dtype=bool)
+            selected[ids] = True
+            mask = selected if mask is None else mask & selected
+
+        if time_range is not None:
+            order = np.load(self._tree_path("time_order.npy"), mmap_mode="r")
+            sorted_ts = records["timestamp"][order]
+            lo = np.searchsorted(sorted_ts, time_range[0], side="left")
+            hi = np.searchsorted(sorted_ts, time_range[1], side="right")
+            narrow(order[lo:hi])
+
+        if bbox is not None:
+            levels, leaf_order = self._load_tree()
+            ids = search_str_tree(levels, leaf_order, bbox, self.meta["node_capacity"])
+            if mask is not None:
+                ids = ids[mask[ids]]
+            rec = records[ids]
+            keep = ((rec["minx"] <= bbox[2]) & (rec["maxx"] >= bbox[0]) &
+                    (rec["miny"] <= bbox[3]) & (rec["maxy"] >= bbox[1]))
+            narrow(ids[keep])
+
+        if mask is None:
+            mask = np.ones(len(records), dtype=bool)
+
+        if time_of_day is not None:
+            tod = time_of_day_index(records["timestamp"], utc_offset)
+            start, end = time_of_day
+            if start <= end:
+                mask &= (tod >= start) & (tod < end)
+            else:
+                # Window wraps past midnight, e.g. (22 * 60, 2 * 60).
+                mask &= (tod >= start) | (tod < end)
+
+        if min_duration is not None:
+            mask &= records["duration"] >= min_duration
+
+        if od_near is not None:
+            (olat, olon), (dlat, dlon), radius_m = od_near
+            mask &= haversine_m(records["origin_lat"], records["origin_lon"], olat, olon) <= radius_m
+            mask &= haversine_m(records["dest_lat"], records["dest_lon"], dlat, dlon) <= radius_m
+
+        return np.nonzero(mask)[0]
+
+    def read_rows(self, ids):
+        """
+        Yield the original CSV rows (as dicts) for the given record indices.
+
+        Rows are read by seeking to their stored offsets, grouped by file and in file order.
+        """
+        records = self.records
+        files = {entry["file_id"]: entry for entry in self.meta["files"]}
+        ids = np.asarray(ids)
+        ids = ids[np.lexsort((records["offset"][ids], records["file_id"][ids]))]
+        handle, handle_id = None, None
+        try:
+            for i in ids:
+                rec = records[i]
+                entry = files[int(rec["file_id"])]
+                if handle_id != entry["file_id"]:
+                    if handle is not None:
+                        handle.close()
+                    handle, handle_id = open(entry["path"], "rb"), entry["file_id"]
+                handle.seek(int(rec["offset"]))
+                text = handle.read(int(rec["length"])).decode("utf-8-sig").strip("\r\n")
+                yield self._resolve(dict(zip(entry["columns"], next(csv.reader([text])))))
+        finally:
+            if handle is not None:
+                handle.close()
+
+    def query(self, bbox=None, time_range=None, time_of_day=None, min_duration=None,
+              od_near=None, utc_offset=None, exact=True):
+        """
+        Find trips matching spatial and temporal constraints.
+
+        Args:
+            bbox (tuple): (minx, miny, maxx, maxy) in lon/lat the route must pass through.
+            time_range (tuple): (start, end) Unix timestamps, inclusive.
+            time_of_day (tuple): (start, end) minutes since local midnight, as in
+                                 decode_timestamp's time_of_day index; end is exclusive.
+            min_duration (float): Minimum trip duration in seconds.
+            od_near (tuple): ((lat, lon), (lat, lon), radius_m) — origin and destination must
+                             each lie within radius_m of the given points.
+            utc_offset (int): Seconds east of UTC for time_of_day; defaults to the local zone.
+            exact (bool): If True and bbox is given, parse the geometry of each candidate and
+                          keep only routes that actually intersect the bbox.
+
+        Yields:
+            dict: Trip rows as stored in the CSV, with "trip_id", "timestamp", "distance"
+                  and "duration" converted to numbers.
+        """
+        ids = self.candidates(bbox, time_range, time_of_day, min_duration, od_near, utc_offset)
+        if exact and bbox is not None:
+            from shapely.geometry import box, LineString
+            query_box = box(*bbox)
+
+        for row in self.read_rows(ids):
+            if exact and bbox is not None:
+                coords = linestring_to_array(row.get("geometry", ""))
+                inside = ((coords[:, 0] >= bbox[0]) & (coords[:, 0] <= bbox[2]) &
+                          (coords[:, 1] >= bbox[1]) & (coords[:, 1] <= bbox[3]))
+                if not inside.any() and not (len(coords) > 1 and LineString(coords).intersects(query_box)):
+                    continue
+            row["trip_id"] = int(row["trip_id"])
+            row["timestamp"] = int(float(row["timestamp"]))
+            row["distance"] = float(row["distance"] or 0.0)
+            row["duration"] = float(row["duration"] or 0.0)
+            yield row
+
+
+def query(bbox=None, time_range=None, min_duration=None, od_near=None, time_of_day=None,
+          index_dir=DEFAULT_INDEX_DIR, geometry_store=None, **kwargs):
+    """
+    Query the trip index at index_dir. See TripIndex.query for the arguments.
+
+    Returns:
+        generator: Matching trip rows, read lazily from the trips CSV files.
+    """
+    index = TripIndex(index_dir, geometry_store=geometry_store)
+    return index.query(bbox=bbox, time_range=time_range, time_of_day=time_of_day,
+                       min_duration=min_duration, od_near=od_near, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the scraped trips index")
+    parser.add_argument("command", choices=["build", "query"])
+    parser.add_argument("--files", default=DEFAULT_TRIP_FILES, help="Glob of trips CSV files to index")
+    parser.add_argument("--index_dir", default=DEFAULT_INDEX_DIR)
+    parser.add_argument("--bbox", type=float, nargs=4, metavar=("MINX", "MINY", "MAXX", "MAXY"))
+    parser.add_argument("--time_range", type=int, nargs=2, metavar=("START", "END"))
+    parser.add_argument("--time_of_day", type=int, nargs=2, metavar=("START_MIN", "END_MIN"))
+    parser.add_argument("--min_duration", type=float)
+    parser.add_argument("--geometry_store", default=None,
+                        help="Geometry store directory for trips written with geometry IDs")
+    args = parser.parse_args()
+
+    store = None
+    if args.geometry_store:
+        from geometry_store import GeometryStore
+        store = GeometryStore(args.geometry_store)
+    index = TripIndex(args.index_dir, geometry_store=store)
+    if args.command == "build":
+        index.update(args.files)
+        return
+
+    count = 0
+    for row in index.query(bbox=args.bbox, time_range=args.time_range,
+                           time_of_day=args.time_of_day, min_duration=args.min_duration):
+        print(f"{row['trip_id']}\t{row['timestamp']}\t{row['distance']}\t{row['duration']}")
+        count += 1
+    print(f"{count} matching trips")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import csv
+import numpy as np
+
+import utils
+
+DERIVED_COLUMNS = [
+    "avg_speed_kmh",
+    "minx", "miny", "maxx", "maxy",
+    "day_of_week", "day_of_year", "time_of_day",
+    "detour_ratio",
+]
+
+
+def validate_routes(rows, bbox=utils.HCM_BBOX, min_speed_kmh=1.0, max_speed_kmh=120.0, utc_offset=None):
+    """
+    Validate and enrich a batch of processed routes in one vectorized pass.
+
+    Args:
+        rows (list): Route dicts with trip_id, timestamp, distance, duration and geometry
+        bbox (tuple): (west, south, east, north) every coordinate must lie in; None to skip
+        min_speed_kmh (float): Slowest plausible average speed
+        max_speed_kmh (float): Fastest plausible average speed
+        utc_offset (int): Seconds east of UTC for the day/time indices; defaults to local
+
+    Returns:
+        tuple: (derived, reasons) where derived maps each DERIVED_COLUMNS name to an array
+               over rows, and reasons is a list with "" for valid rows or a ";"-joined list of
+               the checks a row failed
+    """
+    n = len(rows)
+    distance = np.array([float(r["distance"] or 0.0) for r in rows])
+    duration = np.array([float(r["duration"] or 0.0) for r in rows])
+    timestamp = np.array([int(r["timestamp"]) for r in rows], dtype=np.int64)
+
+    # Concatenate every geometry once and reduce per route
+    coords = [utils.linestring_to_array(r.get("geometry") or "") for r in rows]
+    counts = np.array([len(c) for c in coords], dtype=np.int64)
+    points = np.concatenate(coords) if counts.sum() else np.empty((0, 2))
+    starts = np.cumsum(counts) - counts
+    has_geometry = counts > 0
+
+    minx = np.full(n, np.nan)
+    miny = np.full(n, np.nan)
+    maxx = np.full(n, np.nan)
+    maxy = np.full(n, np.nan)
+    origin = np.full((n, 2), np.nan)
+    dest = np.full((n, 2), np.nan)
+    if has_geometry.any():
+        s = starts[has_geometry]
+        minx[has_geometry] = np.minimum.reduceat(points[:, 0], s)
+        miny[has_geometry] = np.minimum.reduceat(points[:, 1], s)
+        maxx[has_geometry] = np.maximum.reduceat(points[:, 0], s)
+        maxy[has_geometry] = np.maximum.reduceat(points[:, 1], s)
+        origin[has_geometry] = points[s]
+        dest[has_geometry] = points[s + counts[has_geometry] - 1]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_speed_kmh = np.where(duration > 0, distance / duration * 3.6, np.nan)
+        straight = utils.haversine_m(origin[:, 1], origin[:, 0], dest[:, 1], dest[:, 0])
+        detour_ratio = np.where(straight > 0, distance / straight, np.nan)
+    day_of_week, day_of_year, time_of_day = utils.decode_timestamps(timestamp, utc_offset)
+
+    checks = {
+        "empty_geometry": ~has_geometry | (counts < 2),
+        "non_positive_distance": distance <= 0,
+        "non_positive_duration": duration <= 0,
+        "impossible_speed": (avg_speed_kmh < min_speed_kmh) | (avg_speed_kmh > max_speed_kmh),
+        "detour_below_one": detour_ratio < 0.95,
+    }
+    if bbox is not None:
+        west, south, east, north = bbox
+        checks["outside_bbox"] = has_geometry & ((minx < west) | (miny < south) | (maxx > east) | (maxy > north))
+
+    failed = np.column_stack(list(checks.values()))
+    names = np.array(list(checks.keys()))
+    reasons = [";".join(names[row]) for row in failed]
+
+    derived = {
+        "avg_speed_kmh": np.round(avg_speed_kmh, 3),
+        "minx": minx, "miny": miny, "maxx": maxx, "maxy": maxy,
+        "day_of_week": day_of_week, "day_of_year": day_of_year, "time_of_day": time_of_day,
+        "detour_ratio": np.round(detour_ratio, 4),
+    }
+    return derived, reasons
+
+
+def default_quarantine_file(csv_file):
+    """
+    Quarantine CSV for a trips CSV: data/hcm/trips_<ts>.csv -> data/hcm/quarantine/quarantine_<ts>.csv.
+
+    Kept out of the trips*.csv glob that the trip index and coverage map read, so rejected
+    rows never feed back into queries, coverage or cached estimates.
+    """
+    name = os.path.splitext(os.path.basename(csv_file))[0]
+    suffix = name[len("trips"):] if name.startswith("trips") else f"_{name}"
+    return os.path.join(os.path.dirname(csv_file), "quarantine", f"quarantine{suffix}.csv")
+
+
+class TripBatchWriter:
+    def __init__(self, csv_file, quarantine_file=None, batch_size=100, geometry_store=None, **checks):
+        """
+        Buffered trips writer that validates and enriches routes in batches.
+
+        Valid rows are appended to csv_file with DERIVED_COLUMNS after the usual trip
+        columns; rows failing any check go to quarantine_file with a "reason" column.
+
+        Args:
+            csv_file (str): Trips CSV
+            quarantine_file (str): CSV for rejected rows; defaults to quarantine/quarantine_<ts>.csv
+                                   next to a csv_file named trips_<ts>.csv
+            batch_size (int): Rows buffered before a flush
+            geometry_store (GeometryStore): If given, valid rows reference geometries by ID
+            **checks: Thresholds passed to validate_routes (bbox, min_speed_kmh, max_speed_kmh, utc_offset)
+        """
+        self.csv_file = csv_file
+        self.quarantine_file = quarantine_file or default_quarantine_file(csv_file)
+        self.batch_size = batch_size
+        self.geometry_store = geometry_store
+        self.checks = checks
+        self.columns = utils.trip_columns(geometry_store) + DERIVED_COLUMNS
+        self.quarantine_columns = utils.trip_columns() + DERIVED_COLUMNS + ["reason"]
+        self.buffer = []
+        self.written = self.quarantined = 0
+
+    def add(self, route):
+        """Buffer one processed route (trip_id, timestamp, distance, duration, geometry)."""
+        self.buffer.append(route)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    @staticmethod
+    def _append(path, columns, rows):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, mode="a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if write_header:
+                writer.writerow(columns)
+            writer.writerows(rows)
+
+    def flush(self):
+        """Validate the buffered routes and write them out."""
+        if not self.buffer:
+            return
+        rows, self.buffer = self.buffer, []
+        derived, reasons = validate_routes(rows, **self.checks)
+
+        good, bad = [], []
+        for i, (row, reason) in enumerate(zip(rows, reasons)):
+            extra = [derived[column][i] for column in DERIVED_COLUMNS]
+            if reason:
+                bad.append([row[c] for c in utils.trip_columns()] + extra + [reason])
+                continue
+            if self.geometry_store is not None:
+                row["geometry_id"] = self.geometry_store.put(row["geometry"])
+            good.append([row[c] for c in utils.trip_columns(self.geometry_store)] + extra)
+
+        try:
+            if good:
+                self._append(self.csv_file, self.columns, good)
+            if bad:
+                self._append(self.quarantine_file, self.quarantine_columns, bad)
+        except Exception as e:
+            print(f"Error writing to CSV: {e}")
+        if self.geometry_store is not None:
+            self.geometry_store.flush()
+
+        self.written += len(good)
+        self.quarantined += len(bad)
+
+    def close(self):
+        """Flush remaining rows and report totals."""
+        self.flush()
+        print(f"Wrote {self.written} trips, quarantined {self.quarantined} to '{self.quarantine_file}'")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -7,6 +7,7 @@ import pickle
 import time
 import csv
 import sys
+import numpy as np
 
 def decode_geometry(geometry, precision=5):
     """
@@ -34,6 +35,46 @@ def decode_geometry(geometry, precision=5):
         return f"Error decoding polyline: {str(e)}"
     
 
+def linestring_to_array(linestring):
+    """
+    Parse a "LINESTRING (lon lat, ...)" string as written to the trips CSV into an array.
+
+    Args:
+        linestring (str): WKT linestring, possibly empty for routes that failed to decode.
+
+    Returns:
+        np.ndarray: Array of shape (n, 2) with (lon, lat) rows; empty when there is no geometry.
+    """
+    start = linestring.find("(")
+    end = linestring.rfind(")")
+    if start < 0 or end <= start:
+        return np.empty((0, 2))
+    values = linestring[start + 1:end].replace(",", " ").split()
+    return np.array(values, dtype=float).reshape(-1, 2)
+
+
+# Bounding box (HCM region), same as nodes_check.py: (west, south, east, north)
+HCM_BBOX = (106.61140632704878, 10.725169249682512, 106.71831518764178, 10.857456509030797)
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in metres, vectorized over numpy arrays.
+
+    Args:
+        lat1, lon1, lat2, lon2: Coordinates in degrees (scalars or arrays).
+
+    Returns:
+        np.ndarray: Distances in metres.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
 def get_random_od():
 
     df = pd.read_csv("data/hcm/place.csv", encoding="utf-8-sig")
@@ -95,7 +136,114 @@ def decode_timestamp(departure_time):
     return day_of_week_index, day_of_year_index, time_of_day_index
 
 
-def process_mapbox_routes(mapbox_data, csv_file="data/hcm/trips.csv", counter_file="data/pickle_data/trip_counter.pkl"):
+def time_of_day_index(timestamps, utc_offset=None):
+    """
+    Vectorized time-of-day index [0–1439] of Unix timestamps, as in decode_timestamp.
+
+    Args:
+        timestamps (np.ndarray): Unix timestamps in seconds
+        utc_offset (int): Seconds east of UTC; defaults to the local time zone like
+                          datetime.fromtimestamp in decode_timestamp
+
+    Returns:
+        np.ndarray: Minutes since local midnight
+    """
+    if utc_offset is None:
+        utc_offset = time.localtime().tm_gmtoff
+    return ((np.asarray(timestamps, dtype=np.int64) + utc_offset) // 60) % 1440
+
+
+def decode_timestamps(timestamps, utc_offset=None):
+    """
+    Vectorized decode_timestamp over an array of Unix timestamps.
+
+    Args:
+        timestamps (np.ndarray): Unix timestamps in seconds
+        utc_offset (int): Seconds east of UTC; defaults to the local time zone
+
+    Returns:
+        tuple: (day_of_week_index [0–6], day_of_year_index [0–365], time_of_day_index [0–1439]) arrays
+    """
+    if utc_offset is None:
+        utc_offset = time.localtime().tm_gmtoff
+    local = np.asarray(timestamps, dtype=np.int64) + utc_offset
+    days = (local // 86400).astype("datetime64[D]")
+    day_of_week_index = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    day_of_year_index = (days - days.astype("datetime64[Y]")).astype(np.int64)
+    return day_of_week_index, day_of_year_index, time_of_day_index(timestamps, utc_offset)
+
+
+def coordinates_to_linestring(coordinates):
+    """Format decoded (lat, lon) pairs as the "LINESTRING (lon lat, ...)" stored in the trips CSV."""
+    return "LINESTRING (" + ", ".join(f"{lon} {lat}" for lat, lon in coordinates) + ")"
+
+
+def trip_columns(geometry_store=None):
+    """Columns of the trips CSV; geometries are referenced by ID when a geometry store is used."""
+    geometry_column = "geometry" if geometry_store is None else "geometry_id"
+    return ["trip_id", "timestamp", "distance", "duration", geometry_column]
+
+
+def normalize_mapbox_routes(mapbox_data):
+    """
+    Flatten a Mapbox API response into route rows, without trip IDs or file I/O.
+
+    Args:
+        mapbox_data (dict): Mapbox API response data
+
+    Returns:
+        list: [{"distance", "duration", "geometry"}, ...] with geometry as a LINESTRING
+              string, or "" if the polyline could not be decoded
+    """
+    routes = []
+    for i, route in enumerate(mapbox_data.get("routes", [])):
+        # Decode polyline6 geometry
+        geometry = route.get("geometry", "")
+        try:
+            linestring = coordinates_to_linestring(polyline.decode(geometry, precision=6))
+        except Exception as e:
+            print(f"Error decoding geometry for route {i}: {e}")
+            linestring = ""
+
+        routes.append({
+            "distance": route.get("distance", 0.0),
+            "duration": route.get("duration", 0.0),
+            "geometry": linestring
+        })
+    return routes
+
+
+def normalize_tomtom_routes(tomtom_data):
+    """
+    Flatten a TomTom API response into route rows, without trip IDs or file I/O.
+
+    Args:
+        tomtom_data (dict): TomTom API response JSON
+
+    Returns:
+        list: [{"distance", "duration", "geometry"}, ...] with geometry as a LINESTRING
+              string, or "" if the polyline could not be decoded
+    """
+    routes = []
+    for i, route in enumerate(tomtom_data.get("routes", [])):
+        # Extract encoded polyline from the first leg
+        try:
+            leg = route["legs"][0]
+            geometry = leg.get("encodedPolyline", "")
+            linestring = coordinates_to_linestring(polyline.decode(geometry, precision=5))
+        except Exception as e:
+            print(f"Error decoding geometry for route {i}: {e}")
+            linestring = ""
+
+        routes.append({
+            "distance": route.get("summary", {}).get("lengthInMeters", 0.0),
+            "duration": route.get("summary", {}).get("travelTimeInSeconds", 0.0),
+            "geometry": linestring
+        })
+    return routes
+
+
+def process_mapbox_routes(mapbox_data, csv_file="data/hcm/trips.csv", counter_file="data/pickle_data/trip_counter.pkl", geometry_store=None, batch_writer=None):
     """
     Process Mapbox API response to extract routes, assign unique trip IDs, decode geometry,
     and save all routes to a single CSV file.
@@ -104,6 +252,10 @@ def process_mapbox_routes(mapbox_data, csv_file="data/hcm/trips.csv", counter_fi
         mapbox_data (dict): Mapbox API response data
         csv_file (str): Path to CSV file to store routes
         counter_file (str): File to store trip ID counter
+        geometry_store (GeometryStore): If given, geometries are interned in the store and
+                                        rows reference them by geometry_id
+        batch_writer (TripBatchWriter): If given, rows are handed to it for batched validation
+                                        and enrichment instead of being written to csv_file
 
     Returns:
         list: List of processed route dictionaries
@@ -130,45 +282,37 @@ def process_mapbox_routes(mapbox_data, csv_file="data/hcm/trips.csv", counter_fi
         with open(csv_file, mode='a', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
 
-            if write_header:
-                writer.writerow(["trip_id", "timestamp", "distance", "duration", "geometry"])
+            if write_header and batch_writer is None:
+                writer.writerow(trip_columns(geometry_store))
 
-            for route in mapbox_data.get("routes", []):
+            for route in normalize_mapbox_routes(mapbox_data):
                 trip_counter += 1
                 trip_id = trip_counter
 
-                # Decode polyline6 geometry
-                geometry = route.get("geometry", "")
-                try:
-                    coordinates = polyline.decode(geometry, precision=6)
-                    linestring = "LINESTRING (" + ", ".join(
-                        f"{lon} {lat}" for lat, lon in coordinates
-                    ) + ")"
-                except Exception as e:
-                    print(f"Error decoding geometry for trip {trip_id}: {e}")
-                    linestring = ""
-
                 processed_route = {
                     "trip_id": trip_id,
                     "timestamp": current_timestamp,
-                    "distance": route.get("distance", 0.0),
-                    "duration": route.get("duration", 0.0),
-                    "geometry": linestring
+                    **route
                 }
 
-                writer.writerow([
-                    processed_route["trip_id"],
-                    processed_route["timestamp"],
-                    processed_route["distance"],
-                    processed_route["duration"],
-                    processed_route["geometry"]
-                ])
+                if batch_writer is not None:
+                    batch_writer.add(processed_route)
+                    processed_routes.append(processed_route)
+                    continue
+
+                if geometry_store is not None:
+                    processed_route["geometry_id"] = geometry_store.put(route["geometry"])
+
+                writer.writerow([processed_route[column] for column in trip_columns(geometry_store)])
 
                 processed_routes.append(processed_route)
 
     except Exception as e:
         print(f"Error writing to CSV: {e}")
 
+    if geometry_store is not None:
+        geometry_store.flush()
+
     # Save updated trip counter
     try:
         with open(counter_file, "wb") as f:
@@ -213,11 +357,15 @@ def validate_input_file(file_path):
     print(f"Valid input file: {file_path} (contains {len(lines)} entries)")
 
 
-def get_od(od_type):
+def get_od(od_type, geometry_store=None):
     if od_type == "random_od_place":
         org, des = get_random_od()
         return org, des
 
+    elif od_type == "coverage_od":
+        from od_sampler import next_coverage_od
+        return next_coverage_od(geometry_store=geometry_store)
+
     elif od_type == "random_od_seg":
         #TODO
         print("")
@@ -232,7 +380,7 @@ import time
 import pickle
 import polyline  # For decoding encoded polyline from TomTom (precision = 5)
 
-def process_tomtom_routes(tomtom_data, csv_file="data/hcm/trips.csv", counter_file="data/pickle_data/trip_counter.pkl"):
+def process_tomtom_routes(tomtom_data, csv_file="data/hcm/trips.csv", counter_file="data/pickle_data/trip_counter.pkl", geometry_store=None, batch_writer=None):
     """
     Process TomTom API response to extract routes, decode geometry, and store them in a CSV file.
     
@@ -240,6 +388,10 @@ def process_tomtom_routes(tomtom_data, csv_file="data/hcm/trips.csv", counter_fi
         tomtom_data (dict): TomTom API response JSON
         csv_file (str): Output path for CSV file
         counter_file (str): Pickle file to track trip_id counter
+        geometry_store (GeometryStore): If given, geometries are interned in the store and
+                                        rows reference them by geometry_id
+        batch_writer (TripBatchWriter): If given, rows are handed to it for batched validation
+                                        and enrichment instead of being written to csv_file
     
     Returns:
         list: List of processed route dictionaries
@@ -264,46 +416,37 @@ def process_tomtom_routes(tomtom_data, csv_file="data/hcm/trips.csv", counter_fi
         with open(csv_file, mode='a', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
 
-            if write_header:
-                writer.writerow(["trip_id", "timestamp", "distance", "duration", "geometry"])
+            if write_header and batch_writer is None:
+                writer.writerow(trip_columns(geometry_store))
 
-            for route in tomtom_data.get("routes", []):
+            for route in normalize_tomtom_routes(tomtom_data):
                 trip_counter += 1
                 trip_id = trip_counter
 
-                # Extract encoded polyline from the first leg
-                try:
-                    leg = route["legs"][0]
-                    geometry = leg.get("encodedPolyline", "")
-                    coordinates = polyline.decode(geometry, precision=5)
-                    linestring = "LINESTRING (" + ", ".join(
-                        f"{lon} {lat}" for lat, lon in coordinates
-                    ) + ")"
-                except Exception as e:
-                    print(f"Error decoding geometry for trip {trip_id}: {e}")
-                    linestring = ""
-
                 processed_route = {
                     "trip_id": trip_id,
                     "timestamp": current_timestamp,
-                    "distance": route.get("summary", {}).get("lengthInMeters", 0.0),
-                    "duration": route.get("summary", {}).get("travelTimeInSeconds", 0.0),
-                    "geometry": linestring
+                    **route
                 }
 
-                writer.writerow([
-                    processed_route["trip_id"],
-                    processed_route["timestamp"],
-                    processed_route["distance"],
-                    processed_route["duration"],
-                    processed_route["geometry"]
-                ])
+                if batch_writer is not None:
+                    batch_writer.add(processed_route)
+                    processed_routes.append(processed_route)
+                    continue
+
+                if geometry_store is not None:
+                    processed_route["geometry_id"] = geometry_store.put(route["geometry"])
+
+                writer.writerow([processed_route[column] for column in trip_columns(geometry_store)])
 
                 processed_routes.append(processed_route)
 
     except Exception as e:
         print(f"Error writing to CSV: {e}")
 
+    if geometry_store is not None:
+        geometry_store.flush()
+
     # Save counter
     try:
         with open(counter_file, "wb") as f: